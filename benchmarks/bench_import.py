@@ -0,0 +1,68 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+'''Measures how long importing a wolflas module takes in a fresh interpreter
+    and checks that no heavy backend is imported along with it.
+
+    python benchmarks/bench_import.py --budget 1.0'''
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Backends that must only be imported once a feature needs them
+HEAVY_MODULES = ("pptk", "pyautocad", "open3d", "sklearn", "matplotlib", "shapely", "scipy")
+
+_PROBE = """
+import json, sys, time
+_start = time.perf_counter()
+import {module}
+_elapsed = time.perf_counter() - _start
+print(json.dumps({{"seconds": _elapsed,
+                  "heavy": [m for m in {heavy!r} if m in sys.modules]}}))
+"""
+
+
+def measure(module: str = "wolflas.cloud",
+            repeats: int = 5) -> dict:
+    _env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    _probe = _PROBE.format(module=module, heavy=HEAVY_MODULES)
+    _runs = []
+    for _ in range(repeats):
+        _output = subprocess.run([sys.executable, "-c", _probe], env=_env, cwd=ROOT,
+                                 capture_output=True, text=True, check=True).stdout
+        _runs.append(json.loads(_output.strip().splitlines()[-1]))
+
+    _seconds = [run["seconds"] for run in _runs]
+    return {"benchmark": "import",
+            "module": module,
+            "repeats": repeats,
+            "median_seconds": statistics.median(_seconds),
+            "min_seconds": min(_seconds),
+            "heavy_modules": sorted({m for run in _runs for m in run["heavy"]})}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Import time of a wolflas module")
+    parser.add_argument("--module", default="wolflas.cloud")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--budget", type=float, default=None,
+                        help="fail when the median import takes longer (seconds)")
+    args = parser.parse_args()
+
+    result = measure(args.module, args.repeats)
+    print(json.dumps(result, indent=2))
+
+    if result["heavy_modules"]:
+        print(f"Heavy modules imported eagerly: {result['heavy_modules']}", file=sys.stderr)
+        return 1
+    if args.budget is not None and result["median_seconds"] > args.budget:
+        print(f"Import took {result['median_seconds']:.3f}s, budget is {args.budget:.3f}s", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,204 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.synthetic import SCENES, GROUND, TOWER, BUILDING
+from wolflas.cloud import Cloud
+from wolflas.lasreader import read
+from wolflas.laswriter import write
+from wolflas.alphashape import alpha_shape
+from wolflas.normalization import normalize_pointset
+from wolflas.clustering import dbscan, sk_dbscan, tiled_dbscan, cubic_clustering, grid_clustering
+from wolflas.exceptions import BackendError
+
+'''Times the main wolflas stages on seeded synthetic scenes of several sizes.
+    Every scene is written to a temporary las file first so the read stage
+    measures the real decode path. Wall time is the median of the repeats,
+    peak memory comes from one extra run under tracemalloc (numpy reports its
+    buffers to it), so tracing never inflates the timings.
+
+    python benchmarks/run.py --sizes 10000 100000 1000000 --output results.json'''
+
+DEFAULT_SIZES = (10_000, 100_000, 1_000_000)
+
+# cubic_clustering merges one shapely square per point, it only ever runs on
+# the base window of a structure and is capped to keep large sizes feasible
+CUBIC_LIMIT = 5_000
+
+
+def _structure(context: dict) -> np.ndarray:
+    _classification = context["data"]["classification"]
+    return context["data"]["points"][_classification != GROUND]
+
+
+def _base_window(context: dict) -> np.ndarray:
+    """Lowest 5 m of the structure points, where bases are searched for"""
+    _points = _structure(context)
+    _ground = context["data"]["points"][context["data"]["classification"] == GROUND][:, 2]
+    return _points[_points[:, 2] < np.percentile(_ground, 50) + 5]
+
+
+def _stage_read(context: dict) -> tuple:
+    _data = read(context["file"])
+    return len(_data), len(_data)
+
+
+def _stage_dbscan(context: dict) -> tuple:
+    _points = _structure(context)
+    _labels = dbscan(_points, eps=10, return_labels=True)
+    return len(_points), int(_labels.max()) + 1
+
+
+def _stage_sk_dbscan(context: dict) -> tuple:
+    _points = _structure(context)
+    _labels = sk_dbscan(_points, eps=10, return_labels=True)
+    return len(_points), int(_labels.max()) + 1
+
+
+def _stage_tiled_dbscan(context: dict) -> tuple:
+    _points = _structure(context)
+    _labels = tiled_dbscan(_points, eps=10, executor="serial", return_labels=True)
+    return len(_points), int(_labels.max()) + 1
+
+
+def _stage_cubic_clustering(context: dict) -> tuple:
+    _points = _base_window(context)[:CUBIC_LIMIT]
+    return len(_points), len(cubic_clustering(_points, length=2))
+
+
+def _stage_grid_clustering(context: dict) -> tuple:
+    _points = _base_window(context)
+    return len(_points), len(grid_clustering(_points, length=2))
+
+
+def _stage_alpha_shape(context: dict) -> tuple:
+    # Same decimation draw_polygons applies before hulling
+    _points = _structure(context)[::5]
+    _hull = alpha_shape(_points, alpha=0.3)[0]
+    return len(_points), len(getattr(_hull, "geoms", [_hull]))
+
+
+def _stage_normalize_pointset(context: dict) -> tuple:
+    _normalized, _, _ = normalize_pointset(context["data"]["points"])
+    return len(_normalized), len(_normalized)
+
+
+def _stage_find_bottoms(context: dict) -> tuple:
+    _cloud = Cloud(None)
+    _cloud.load_points(context["data"])
+    _classification = TOWER if TOWER in _cloud.unique_classes else BUILDING
+    _bottoms = _cloud.find_bottoms(_classification)
+    return _cloud.class_index.count(_classification), len(_bottoms)
+
+
+STAGES = {"read": _stage_read,
+          "dbscan": _stage_dbscan,
+          "sk_dbscan": _stage_sk_dbscan,
+          "tiled_dbscan": _stage_tiled_dbscan,
+          "cubic_clustering": _stage_cubic_clustering,
+          "grid_clustering": _stage_grid_clustering,
+          "alpha_shape": _stage_alpha_shape,
+          "normalize_pointset": _stage_normalize_pointset,
+          "find_bottoms": _stage_find_bottoms}
+
+
+def measure(stage,
+            context: dict,
+            repeats: int = 3) -> dict:
+    """Median wall time over repeats and traced peak allocation of one stage"""
+    _seconds = []
+    for _ in range(repeats):
+        _start = time.perf_counter()
+        _points_in, _points_out = stage(context)
+        _seconds.append(time.perf_counter() - _start)
+
+    tracemalloc.start()
+    try:
+        stage(context)
+        _, _peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {"seconds": statistics.median(_seconds),
+            "min_seconds": min(_seconds),
+            "peak_bytes": _peak,
+            "points_in": _points_in,
+            "points_out": _points_out}
+
+
+def _commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def run(sizes=DEFAULT_SIZES,
+        scenes=tuple(SCENES),
+        stages=tuple(STAGES),
+        repeats: int = 3,
+        seed: int = 0) -> dict:
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for scene in scenes:
+            for size in sizes:
+                _data = SCENES[scene](size, seed=seed)
+                # Format 6 keeps classes over 31 (poles are class 46)
+                write(_data, point_format=6, version="1.4", filename=f"{scene}_{size}", path=directory)
+                context = {"data": _data, "file": os.path.join(directory, f"{scene}_{size}.las")}
+
+                for stage in stages:
+                    _result = {"scene": scene, "size": size, "stage": stage}
+                    try:
+                        _result.update(measure(STAGES[stage], context, repeats))
+                        _result["status"] = "ok"
+                    except BackendError as error:
+                        _result["status"] = "skipped"
+                        _result["reason"] = str(error)
+                    results.append(_result)
+                    print(json.dumps(_result), file=sys.stderr)
+
+    return {"benchmark": "stages",
+            "commit": _commit(),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "seed": seed,
+            "repeats": repeats,
+            "results": results}
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Wall time and peak memory of wolflas stages")
+    parser.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES))
+    parser.add_argument("--scenes", nargs="+", choices=tuple(SCENES), default=list(SCENES))
+    parser.add_argument("--stages", nargs="+", choices=tuple(STAGES), default=list(STAGES))
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="json file to write, stdout when omitted")
+    args = parser.parse_args()
+
+    report = run(args.sizes, args.scenes, args.stages, args.repeats, args.seed)
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,128 @@
+import numpy as np
+
+from wolflas.pointdata import PointData
+
+'''Seeded synthetic LiDAR scenes for benchmarking. Every generator returns a
+    PointData with las style classes, so scenes can be written to temporary
+    las files and read back through the normal pipeline.'''
+
+GROUND = 2
+BUILDING = 6
+TOWER = 15
+POLE = 46
+
+
+def _terrain(rng: np.random.Generator,
+             count: int,
+             extent: float) -> np.ndarray:
+    """Gently rolling ground surface"""
+    _xy = rng.uniform(0, extent, (count, 2))
+    _z = 100 + 5 * np.sin(_xy[:, 0] / 150) + 3 * np.cos(_xy[:, 1] / 90) + rng.normal(0, 0.05, count)
+    return np.column_stack((_xy, _z))
+
+
+def _ground_height(xy: np.ndarray) -> np.ndarray:
+    return 100 + 5 * np.sin(xy[..., 0] / 150) + 3 * np.cos(xy[..., 1] / 90)
+
+
+def _tower(rng: np.random.Generator,
+           center: np.ndarray,
+           count: int,
+           height: float,
+           footprint: float = 4.0) -> np.ndarray:
+    """Four tapering lattice legs meeting under a top"""
+    _z = rng.uniform(0, height, count)
+    _shrink = 1 - 0.8 * _z / height
+    _legs = rng.integers(0, 4, count)
+    _corner = np.array([[-1, -1], [1, -1], [-1, 1], [1, 1]])[_legs] * footprint
+    _xy = center + _corner * _shrink[:, None] + rng.normal(0, 0.15, (count, 2))
+    return np.column_stack((_xy, _z + _ground_height(center)))
+
+
+def _pole(rng: np.random.Generator,
+          center: np.ndarray,
+          count: int,
+          height: float) -> np.ndarray:
+    _z = rng.uniform(0, height, count)
+    _xy = center + rng.normal(0, 0.12, (count, 2))
+    return np.column_stack((_xy, _z + _ground_height(center)))
+
+
+def _building(rng: np.random.Generator,
+              corner: np.ndarray,
+              count: int,
+              size: np.ndarray,
+              height: float) -> np.ndarray:
+    """Flat roof of an L shaped footprint"""
+    _xy = corner + rng.uniform(0, 1, (count * 2, 2)) * size
+    _local = (_xy - corner) / size
+    _xy = _xy[~((_local[:, 0] > 0.5) & (_local[:, 1] > 0.5))][:count]
+    _z = _ground_height(corner) + height + rng.normal(0, 0.05, len(_xy))
+    return np.column_stack((_xy, _z))
+
+
+def _to_point_data(rng: np.random.Generator,
+                   parts: list) -> PointData:
+    _points = np.vstack([points for points, _ in parts])
+    _classes = np.concatenate([np.full(len(points), classification, dtype=np.uint8)
+                               for points, classification in parts])
+    # Shuffled like a real flight line, so nothing relies on point order
+    _order = rng.permutation(len(_points))
+
+    data = PointData.empty(len(_points))
+    for name in data.columns:
+        data[name] = 0
+    data["points"] = _points[_order]
+    data["classification"] = _classes[_order]
+    data["intensity"] = rng.integers(0, 4096, len(_points))
+    data["return_number"] = 1
+    data["number_of_returns"] = 1
+    data["gps_time"] = np.sort(rng.uniform(0, 1000, len(_points)))
+    return data
+
+
+def corridor_scene(point_count: int,
+                   seed: int = 0,
+                   towers: int = 20,
+                   poles: int = 40) -> PointData:
+    """Transmission corridor: terrain with lattice towers and distribution
+       poles. About 60% of the points are ground."""
+    rng = np.random.default_rng(seed)
+    _extent = max(500.0, np.sqrt(point_count) * 2)
+    _structure_points = int(point_count * 0.4)
+    _per_tower = max(50, int(_structure_points * 0.8) // towers)
+    _per_pole = max(20, int(_structure_points * 0.2) // poles)
+
+    parts = [(_terrain(rng, point_count - _per_tower * towers - _per_pole * poles, _extent), GROUND)]
+    # Towers spaced out along the corridor so they never touch
+    _line = np.linspace(0.05, 0.95, towers)[:, None] * _extent
+    for center in np.column_stack((_line, _line * 0.5 + _extent * 0.25)):
+        parts.append((_tower(rng, center, _per_tower, rng.uniform(25, 45)), TOWER))
+    for center in rng.uniform(0, _extent, (poles, 2)):
+        parts.append((_pole(rng, center, _per_pole, rng.uniform(9, 14)), POLE))
+    return _to_point_data(rng, parts)
+
+
+def building_scene(point_count: int,
+                   seed: int = 0,
+                   buildings: int = 30) -> PointData:
+    """Terrain with L shaped building roofs on a regular block grid"""
+    rng = np.random.default_rng(seed)
+    _blocks = int(np.ceil(np.sqrt(buildings)))
+    _extent = _blocks * 80.0
+    _per_building = max(100, int(point_count * 0.5) // buildings)
+
+    parts = [(_terrain(rng, point_count - _per_building * buildings, _extent), GROUND)]
+    for key in range(buildings):
+        _corner = np.array([key % _blocks, key // _blocks]) * 80.0 + 10
+        parts.append((_building(rng, _corner, _per_building, rng.uniform(25, 55, 2), rng.uniform(4, 12)),
+                      BUILDING))
+    return _to_point_data(rng, parts)
+
+
+SCENES = {"corridor": corridor_scene,
+          "buildings": building_scene}
+
+
+if __name__ == "__main__":
+    pass
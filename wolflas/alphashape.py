@@ -1,15 +1,25 @@
 import numpy as np
-import shapely.geometry as geometry
-import math
 
 from numpy import ndarray
-from shapely.ops import unary_union, polygonize
-from shapely import simplify
-from scipy.spatial import Delaunay
+from wolflas.backends import lazy_module
+
+shapely = lazy_module("shapely")
+scipy_spatial = lazy_module("scipy.spatial")
+scipy_sparse = lazy_module("scipy.sparse")
+csgraph = lazy_module("scipy.sparse.csgraph")
+
+
+def _unique_edges(simplices: ndarray,
+                  point_count: int) -> tuple:
+    """Unique vertex pairs of a set of triangles and how many triangles use each"""
+    edges = np.sort(np.concatenate((simplices[:, [0, 1]], simplices[:, [1, 2]], simplices[:, [2, 0]])), axis=1)
+    keys, counts = np.unique(edges[:, 0] * point_count + edges[:, 1], return_counts=True)
+    return np.column_stack((keys // point_count, keys % point_count)), counts
 
 
 def alpha_shape(points: ndarray,
-                alpha: float):
+                alpha: float,
+                return_mask: bool = False):
     """
        Compute the alpha shape (concave hull) of a set
        of points.
@@ -18,54 +28,73 @@ def alpha_shape(points: ndarray,
            gooeyness of the border. Smaller numbers
            don't fall inward as much as larger numbers.
            Too large, and you lose everything!
+       @param return_mask: also return the boolean mask of
+           the Delaunay triangles (tri.simplices) covered
+           by the hull.
+       @return: the hull, an (n, 2, 2) array with the unique
+           edges of every kept triangle and, if asked for,
+           the triangle mask.
        """
 
     if len(points) < 4:
-        return geometry.MultiPoint(list(points)).convex_hull
-
-    def add_edge(edges, edge_points, coords, i, j):
-        """
-        Add a line between the i-th and j-th points,
-        if not in the list already
-        """
-        if (i, j) in edges or (j, i) in edges:
-            return
-        edges.add((i, j))
-        edge_points.append(coords[[i, j]])
-    points = np.delete(points, 2, 1)
-    tri = Delaunay(points)
-    edges = set()
-    edge_points = []
-    # loop over triangles:
-    # ia, ib, ic = indices of corner points of the triangle
-    for ia, ib, ic in tri.vertices:
-        pa = points[ia]
-        pb = points[ib]
-        pc = points[ic]
-
-        # Lengths of sides of triangle
-        a = math.sqrt((pa[0] - pb[0]) ** 2 + (pa[1] - pb[1]) ** 2)
-        b = math.sqrt((pb[0] - pc[0]) ** 2 + (pb[1] - pc[1]) ** 2)
-        c = math.sqrt((pc[0] - pa[0]) ** 2 + (pc[1] - pa[1]) ** 2)
-
-        # Semi-perimeter of triangle
-        s = (a + b + c) / 2.0
-
-        # Area of triangle by Heron's formula
-        area = math.sqrt(s * (s - a) * (s - b) * (s - c))
-        if area > 0:
-            circum_r = a * b * c / (4.0 * area)
-
-        # Here's the radius filter.
-        # print circum_r
-        if circum_r < 1.0 / alpha:
-            add_edge(edges, edge_points, points, ia, ib)
-            add_edge(edges, edge_points, points, ib, ic)
-            add_edge(edges, edge_points, points, ic, ia)
-
-    m = geometry.MultiLineString(edge_points)
-    triangles = list(polygonize(m))
-    return unary_union(triangles), edge_points
+        _hull = shapely.MultiPoint(list(points)).convex_hull
+        _edges = np.empty((0, 2, 2))
+        return (_hull, _edges, np.empty(0, dtype=bool)) if return_mask else (_hull, _edges)
+
+    coords = np.ascontiguousarray(points[:, :2], dtype=np.float64)
+    tri = scipy_spatial.Delaunay(coords)
+
+    # Lengths of sides of every triangle at once
+    corners = coords[tri.simplices]
+    a = np.linalg.norm(corners[:, 0] - corners[:, 1], axis=1)
+    b = np.linalg.norm(corners[:, 1] - corners[:, 2], axis=1)
+    c = np.linalg.norm(corners[:, 2] - corners[:, 0], axis=1)
+
+    # Semi-perimeter and area of triangles by Heron's formula
+    s = (a + b + c) / 2.0
+    area = np.sqrt(np.clip(s * (s - a) * (s - b) * (s - c), 0, None))
+
+    # Here's the radius filter. Degenerate triangles get an
+    # infinite circumradius and are dropped
+    with np.errstate(divide="ignore", invalid="ignore"):
+        circum_r = a * b * c / (4.0 * area)
+    mask = np.isfinite(circum_r) & (circum_r < 1.0 / alpha)
+
+    # Triangles dropped by the filter but fully enclosed by kept ones
+    # are filled in, as polygonizing the kept edges always did. Dropped
+    # triangles are flood filled from the convex hull through their
+    # shared edges, whatever the fill cannot reach lies inside the shape
+    dropped = np.flatnonzero(~mask)
+    neighbours = tri.neighbors[dropped]
+    touches_hull = np.any(neighbours < 0, axis=1)
+    _rows = np.repeat(np.arange(len(dropped)), 3)
+    _cols = neighbours.ravel()
+    _link = (_cols >= 0) & ~mask[np.maximum(_cols, 0)]
+    _position = np.full(len(mask), -1)
+    _position[dropped] = np.arange(len(dropped))
+    _graph = scipy_sparse.coo_matrix((np.ones(np.count_nonzero(_link)), (_rows[_link], _position[_cols[_link]])),
+                                     shape=(len(dropped), len(dropped)))
+    _, components = csgraph.connected_components(_graph, directed=False)
+    outside = np.isin(components, components[touches_hull])
+    filled = mask.copy()
+    filled[dropped[~outside]] = True
+
+    # Every edge of the kept triangles keyed by its sorted vertex pair.
+    # Edges used by a single filled triangle are the boundary of the shape
+    unique_edges, _ = _unique_edges(tri.simplices[mask], len(coords))
+    filled_edges, counts = _unique_edges(tri.simplices[filled], len(coords))
+    boundary = filled_edges[counts == 1]
+
+    # Only the boundary is polygonized rather than every triangle edge
+    faces = []
+    if len(boundary) > 0:
+        faces = list(shapely.polygonize(shapely.linestrings(coords[boundary])).geoms)
+
+    hull = shapely.unary_union(faces)
+    edge_points = coords[unique_edges]
+    if return_mask:
+        return hull, edge_points, filled
+    return hull, edge_points
 
 
 if __name__ == "__main__":
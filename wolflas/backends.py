@@ -0,0 +1,46 @@
+import importlib
+
+from types import ModuleType
+from wolflas.exceptions import BackendError
+
+'''Heavy and optional dependencies (viewer, CAD, clustering engines, plotting,
+    geometry) are bound to module level names as LazyModules. The real import
+    happens on the first attribute access, so importing wolflas stays fast and
+    works on hosts missing a backend until that backend is actually used.'''
+
+
+class LazyModule(ModuleType):
+    def __init__(self,
+                 name: str) -> None:
+        super().__init__(name)
+        self._module = None
+
+    def _load(self) -> ModuleType:
+        if self._module is None:
+            try:
+                self._module = importlib.import_module(self.__name__)
+            except ImportError as error:
+                raise BackendError(f"{self.__name__} is needed for this feature but could not be imported") \
+                    from error
+        return self._module
+
+    def __getattr__(self,
+                    attribute: str):
+        return getattr(self._load(), attribute)
+
+
+def lazy_module(name: str) -> LazyModule:
+    return LazyModule(name)
+
+
+def is_available(name: str) -> bool:
+    """Checks whether a backend can be imported, importing it if so"""
+    try:
+        lazy_module(name)._load()
+    except BackendError:
+        return False
+    return True
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,163 @@
+import numpy as np
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+
+from numpy import ndarray
+from typing import Union
+from wolflas.pointdata import PointData, FIELD_NAMES
+
+'''Sidecar cache of decoded las columns. Each column is saved as its own
+    .npy file so later opens can memory map them instead of decoding the
+    las file again. Mapped pages live in the OS page cache and are shared
+    by every process that opens the same tile.
+    Cluster labels get a separate, size bounded cache keyed by the content
+    of the clustered points and the clustering parameters.'''
+
+# Default cache folder created next to the las file
+CACHE_FOLDER = ".wolflas_cache"
+
+# Default label cache, shared by every file clustered by the user
+LABEL_CACHE_DIR = os.path.join(os.path.expanduser("~"), CACHE_FOLDER, "labels")
+
+# Label cache size above which the least recently used entries are evicted
+LABEL_CACHE_BYTES = 2 ** 30
+
+
+def path_key(file: str) -> str:
+    """Key shared by every version of a file, from its absolute path"""
+    return hashlib.sha1(os.path.abspath(file).encode("utf-8")).hexdigest()[:16]
+
+
+def cache_key(file: str) -> str:
+    """Key identifying one version of a file by its path, size and mtime"""
+    _stat = os.stat(file)
+    _identity = f"{os.path.abspath(file)}|{_stat.st_size}|{_stat.st_mtime_ns}"
+    return hashlib.sha1(_identity.encode("utf-8")).hexdigest()
+
+
+def _cache_prefix(file: str) -> str:
+    """Name prefix of every cached version of file. The path key keeps files
+       of the same name in a shared cache_dir apart."""
+    return f"{os.path.basename(file)}-{path_key(file)}-"
+
+
+def cache_path(file: str,
+               cache_dir: Union[str, None] = None) -> str:
+    if cache_dir is None:
+        cache_dir = os.path.join(os.path.dirname(os.path.abspath(file)), CACHE_FOLDER)
+    return os.path.join(cache_dir, f"{_cache_prefix(file)}{cache_key(file)}")
+
+
+def load_cached(file: str,
+                cache_dir: Union[str, None] = None) -> Union[PointData, None]:
+    """Memory maps the cached columns of file, or returns None when the file
+       has no up to date cache. Columns are mapped copy-on-write so edits
+       (ex. convert_class) never reach the cache."""
+    _path = cache_path(file, cache_dir)
+    if not os.path.isdir(_path):
+        return None
+
+    logging.info(f"Mapping cached columns {_path}")
+    return PointData({name: np.load(os.path.join(_path, f"{name}.npy"), mmap_mode="c")
+                      for name in FIELD_NAMES})
+
+
+def save_cache(file: str,
+               data: PointData,
+               cache_dir: Union[str, None] = None) -> str:
+    """Saves data as the cache of file and drops caches of older versions
+       of the same file. The cache is written to a temporary folder and
+       renamed into place so concurrent readers never see a partial cache."""
+    _path = cache_path(file, cache_dir)
+    _root = os.path.dirname(_path)
+    os.makedirs(_root, exist_ok=True)
+
+    _prefix = _cache_prefix(file)
+    for entry in os.listdir(_root):
+        if entry.startswith(_prefix) and os.path.join(_root, entry) != _path:
+            shutil.rmtree(os.path.join(_root, entry), ignore_errors=True)
+
+    _staging = tempfile.mkdtemp(dir=_root, prefix=".staging-")
+    try:
+        for name in FIELD_NAMES:
+            np.save(os.path.join(_staging, f"{name}.npy"), data[name])
+        os.rename(_staging, _path)
+    except OSError:
+        # Another process finished the same cache first
+        shutil.rmtree(_staging, ignore_errors=True)
+        if not os.path.isdir(_path):
+            raise
+    return _path
+
+
+def clear_cache(file: str,
+                cache_dir: Union[str, None] = None) -> None:
+    shutil.rmtree(cache_path(file, cache_dir), ignore_errors=True)
+
+
+def labels_key(points: ndarray,
+               **params) -> str:
+    """Key of a clustering run from the bytes of the points and every
+       parameter that changes the labels (eps, min_count, backend...)"""
+    _points = np.ascontiguousarray(points)
+    _hash = hashlib.blake2b(digest_size=20)
+    _hash.update(f"{_points.dtype.str}|{_points.shape}|{sorted(params.items())}".encode("utf-8"))
+    _hash.update(memoryview(_points).cast("B"))
+    return _hash.hexdigest()
+
+
+def load_labels(key: str,
+                cache_dir: Union[str, None] = None) -> Union[ndarray, None]:
+    """Cached labels of key, or None. A hit marks the entry as recently used."""
+    _path = os.path.join(cache_dir or LABEL_CACHE_DIR, f"{key}.npy")
+    try:
+        labels = np.load(_path)
+    except (OSError, ValueError):
+        return None
+    os.utime(_path)
+    logging.info(f"Cluster labels loaded from cache {_path}")
+    return labels
+
+
+def save_labels(key: str,
+                labels: ndarray,
+                cache_dir: Union[str, None] = None,
+                max_bytes: int = LABEL_CACHE_BYTES) -> str:
+    """Saves labels under key, then evicts the least recently used
+       entries until the cache holds at most max_bytes"""
+    _root = cache_dir or LABEL_CACHE_DIR
+    os.makedirs(_root, exist_ok=True)
+    _path = os.path.join(_root, f"{key}.npy")
+
+    # Written aside and renamed so readers never load a partial array
+    _fd, _staging = tempfile.mkstemp(dir=_root, prefix=".staging-", suffix=".npy")
+    with os.fdopen(_fd, "wb") as f:
+        np.save(f, labels)
+    os.replace(_staging, _path)
+
+    _entries = []
+    for entry in os.scandir(_root):
+        if entry.name.endswith(".npy") and not entry.name.startswith(".staging-"):
+            _stat = entry.stat()
+            _entries.append((_stat.st_mtime_ns, _stat.st_size, entry.path))
+    _total = sum(size for _, size, _ in _entries)
+    for _, size, path in sorted(_entries):
+        if _total <= max_bytes or path == _path:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        _total -= size
+    return _path
+
+
+def clear_labels(cache_dir: Union[str, None] = None) -> None:
+    shutil.rmtree(cache_dir or LABEL_CACHE_DIR, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    pass
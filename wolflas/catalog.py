@@ -0,0 +1,140 @@
+import os
+
+import numpy as np
+import laspy
+import logging
+
+from typing import Iterator, List, NamedTuple, Sequence, Tuple, Union
+from wolflas.cloud import Cloud
+from wolflas.lasreader import read_chunks, select_fields, DEFAULT_CHUNK_SIZE
+from wolflas.pointdata import PointData
+from wolflas.parallel import map_tasks
+from wolflas.instrumentation import span
+from wolflas.backends import lazy_module
+
+shapely = lazy_module("shapely")
+
+'''Catalog of a directory of las/laz tiles. Only the headers are read when
+    the catalog is built, tile extents go into an STRtree (R-tree) and queries
+    stream the points of the tiles they touch, so a structure split over
+    several tiles comes back as one Cloud.'''
+
+# Extensions picked up when scanning a directory
+TILE_EXTENSIONS = (".las", ".laz")
+
+
+class Tile(NamedTuple):
+    path: str
+    bounds: Tuple[float, float, float, float, float, float]
+    point_count: int
+    version: str
+    point_format: int
+
+
+def read_tile(path: str) -> Tile:
+    """Header of one las/laz file, no points are decoded"""
+    with laspy.open(path) as fh:
+        _header = fh.header
+        return Tile(path=path,
+                    bounds=(*map(float, _header.mins), *map(float, _header.maxs)),
+                    point_count=int(_header.point_count),
+                    version=str(_header.version),
+                    point_format=int(_header.point_format.id))
+
+
+def _tile_files(directory: str,
+                recursive: bool = False) -> List[str]:
+    if not recursive:
+        _names = sorted(os.listdir(directory))
+        return [os.path.join(directory, name) for name in _names
+                if name.lower().endswith(TILE_EXTENSIONS) and os.path.isfile(os.path.join(directory, name))]
+    _files = []
+    for root, _, names in os.walk(directory):
+        _files.extend(os.path.join(root, name) for name in names if name.lower().endswith(TILE_EXTENSIONS))
+    return sorted(_files)
+
+
+class Catalog:
+    def __init__(self,
+                 directory: str,
+                 recursive: bool = False,
+                 executor: str = "thread",
+                 workers: Union[int, None] = None) -> None:
+        """Reads the header of every las/laz file in directory (and its
+           sub directories when recursive). Headers are read on the given
+           executor, threads by default as the work is file I/O."""
+        logging.info(f"Cataloging {directory}")
+        self.directory = directory
+        self.tiles = list(map_tasks(read_tile, ((path,) for path in _tile_files(directory, recursive)),
+                                    executor=executor, workers=workers))
+        self._tree = None
+        logging.info(f"{len(self.tiles)} tiles cataloged")
+
+    def __len__(self) -> int:
+        return len(self.tiles)
+
+    @property
+    def point_count(self) -> int:
+        return sum(tile.point_count for tile in self.tiles)
+
+    @property
+    def bounds(self) -> Tuple[float, float, float, float, float, float]:
+        _bounds = np.array([tile.bounds for tile in self.tiles])
+        return (*_bounds[:, :3].min(axis=0).tolist(), *_bounds[:, 3:].max(axis=0).tolist())
+
+    @property
+    def tree(self):
+        """STRtree over the XY extent of every tile, built on first use"""
+        if self._tree is None:
+            _extents = np.array([tile.bounds for tile in self.tiles]).reshape(-1, 6)
+            self._tree = shapely.STRtree(shapely.box(_extents[:, 0], _extents[:, 1], _extents[:, 3], _extents[:, 4]))
+        return self._tree
+
+    def intersecting(self,
+                     bbox: Union[Tuple[float, float, float, float], None] = None) -> List[Tile]:
+        """Tiles whose extent touches the (xmin, ymin, xmax, ymax) box, in
+           catalog order. Every tile when bbox is None."""
+        if bbox is None:
+            return list(self.tiles)
+        _positions = np.sort(self.tree.query(shapely.box(*bbox), predicate="intersects"))
+        return [self.tiles[p] for p in _positions]
+
+    def chunks(self,
+               bbox: Union[Tuple[float, float, float, float], None] = None,
+               classes: Union[Sequence[int], None] = None,
+               chunk_size: int = DEFAULT_CHUNK_SIZE,
+               coordinates: str = "float64",
+               fields: Union[Sequence[str], None] = None) -> Iterator[PointData]:
+        """Streams the points inside bbox and of the given classes from the
+           intersecting tiles, one filtered chunk at a time. The filters and
+           fields are passed to read_chunks, so rows are dropped before
+           their fields are decoded. coordinates is the storage of the
+           points, see lasreader.read."""
+        for tile in self.intersecting(bbox):
+            yield from read_chunks(tile.path, chunk_size=chunk_size, fields=fields, classes=classes,
+                                   bbox=bbox, coordinates=coordinates)
+
+    def query(self,
+              bbox: Union[Tuple[float, float, float, float], None] = None,
+              classes: Union[Sequence[int], None] = None,
+              chunk_size: int = DEFAULT_CHUNK_SIZE,
+              coordinates: str = "float64",
+              fields: Union[Sequence[str], None] = None) -> Cloud:
+        """Cloud of the points inside bbox and of the given classes across
+           every tile. Only tiles touching bbox are opened. fields limits the
+           attributes decoded as in Cloud (classification is always kept).
+           Quantized tiles on different grids are joined as float64."""
+        _fields = None if fields is None else select_fields(list(fields) + ["classification"])
+        _tiles = self.intersecting(bbox)
+        logging.info(f"Querying {len(_tiles)} of {len(self.tiles)} tiles")
+        with span("catalog_query", sum(tile.point_count for tile in _tiles)) as _span:
+            _data = PointData.concatenate(self.chunks(bbox, classes, chunk_size, coordinates, _fields))
+            _span.points_out = len(_data)
+
+        cloud = Cloud(None)
+        cloud.load_points(_data)
+        return cloud
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,59 @@
+import numpy as np
+
+from numpy import ndarray
+from typing import Dict
+
+# Number of distinct class values a las classification byte can hold
+CLASS_COUNT = 256
+
+
+class ClassIndex:
+    """Point indices grouped by classification with one counting sort.
+       The indices of class c are order[bounds[c]:bounds[c + 1]], in their
+       original order, so lookups, counts and the list of classes cost
+       O(number of classes) instead of a pass over every point."""
+
+    def __init__(self,
+                 classification: ndarray) -> None:
+        self.counts = np.bincount(classification, minlength=CLASS_COUNT).astype(np.int64)
+        # A stable sort of uint8 keys is a counting (radix) sort in numpy
+        self.order = np.argsort(classification, kind="stable")
+        self.bounds = np.zeros(CLASS_COUNT + 1, dtype=np.int64)
+        np.cumsum(self.counts, out=self.bounds[1:])
+
+    @property
+    def classes(self) -> ndarray:
+        return np.flatnonzero(self.counts).astype(np.uint8)
+
+    def histogram(self) -> Dict[int, int]:
+        return {int(c): int(self.counts[c]) for c in self.classes}
+
+    def count(self,
+              classification: int) -> int:
+        return int(self.counts[classification])
+
+    def indices(self,
+                classification: int) -> ndarray:
+        return self.order[self.bounds[classification]:self.bounds[classification + 1]]
+
+    def remap(self,
+              classification: int,
+              new_class: int) -> None:
+        """Moves every index of classification into new_class. Only the part
+           of order between the two classes is rewritten."""
+        if classification == new_class:
+            return
+
+        _merged = np.sort(np.concatenate((self.indices(classification), self.indices(new_class))))
+        _low, _high = min(classification, new_class), max(classification, new_class)
+        _region = [_merged if c == new_class else self.indices(c)
+                   for c in range(_low, _high + 1) if c != classification]
+        self.order[self.bounds[_low]:self.bounds[_high + 1]] = np.concatenate(_region)
+
+        self.counts[new_class] += self.counts[classification]
+        self.counts[classification] = 0
+        np.cumsum(self.counts, out=self.bounds[1:])
+
+
+if __name__ == "__main__":
+    pass
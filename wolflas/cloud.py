@@ -1,72 +1,302 @@
-import sys
+import os
+import functools
 
 import numpy as np
-import pptk
+import laspy
 import logging
 
 from wolflas.alphashape import alpha_shape
-from wolflas.lasreader import read
-from wolflas.laswriter import write
-from typing import Union, List
+from wolflas.lasreader import read, read_chunks, select_fields, DEFAULT_CHUNK_SIZE
+from wolflas.laswriter import write_chunks
+from typing import Callable, Dict, Union, List, Iterator, Sequence, Tuple
+from wolflas.pointdata import PointData, LAS_ATTRIBUTES
+from wolflas.cache import load_cached, save_cache
+from wolflas.spatial import SpatialIndex
+from wolflas.classindex import ClassIndex
 from wolflas.normalization import normalize_pointset, revert_normalization
-from wolflas.clustering import dbscan, cubic_clustering, sk_dbscan
+from wolflas.clustering import dbscan, grid_clustering, group_labels, sk_dbscan
+from wolflas.parallel import map_clusters
+from wolflas.export import HullSink, open_sink
+from wolflas.instrumentation import Recorder, span
+from wolflas.thinning import cell_means, thin, thin_indices
+from wolflas.raster import GroundModel, Raster, rasterize
+from wolflas.features import geometric_features
+from wolflas.hulls import base_centroids, merge_hulls, simplify_hulls
 from numpy import ndarray
-from pyautocad import Autocad, APoint
-from shapely import MultiPolygon, Polygon, delaunay_triangles
-from scipy.spatial.distance import cdist
-from wolflas.exceptions import InvalidClassError, VersionError
-
-
-logging.basicConfig(level=logging.INFO)
+from wolflas.exceptions import ExtractionError, InvalidClassError, StreamError, ThinningError, VersionError
+from wolflas.backends import lazy_module
+
+pptk = lazy_module("pptk")
+shapely = lazy_module("shapely")
+
+# Features Cloud.extract can find per cluster
+FEATURE_KINDS = ("bottoms", "tops")
+
+# Clustering used by Cloud.extract, all of them take cache=
+CLUSTERERS = {"dbscan": dbscan,
+              "sk_dbscan": sk_dbscan}
+
+# Clustering of each feature kind by default, as in find_bottoms and
+# find_single_tops
+KIND_CLUSTERING = {"bottoms": "dbscan",
+                   "tops": "sk_dbscan"}
+
+# One row per extracted point: its class, the cluster within that class,
+# the feature kind and the position
+FEATURE_DTYPE = np.dtype([("classification", np.uint8),
+                          ("cluster", np.int64),
+                          ("kind", "U7"),
+                          ("x", np.float64),
+                          ("y", np.float64),
+                          ("z", np.float64)])
+
+
+def _cluster_bottoms(cluster: ndarray,
+                     tolerance: float = 5,
+                     length: float = 2,
+                     ground: Union[GroundModel, None] = None) -> List:
+    """Finding our lowest point and then finding all points within a tolerance.
+       With a ground model the window is the points within tolerance of the
+       terrain instead, falling back to the lowest point when none are.
+       Every base found in that window gives one bottom, bases of 4 points
+       or more at the centroid of their convex hull."""
+    with span("window", len(cluster)) as _span:
+        _points_in_window = cluster[:0]
+        if ground is not None:
+            _points_in_window = cluster[cluster[:, 2] - ground.height_at(cluster) < tolerance]
+        if len(_points_in_window) == 0:
+            _lowest_height = cluster[:, 2].min()
+            _points_in_window = cluster[cluster[:, 2] < _lowest_height + tolerance]
+        _span.points_out = len(_points_in_window)
+
+    _bases = grid_clustering(_points_in_window, length)
+    # Centroids of every large base of the cluster in one batch
+    _large = [base for base in _bases if len(base) >= 4]
+    _centroids = iter(base_centroids(_large))
+
+    _bottoms = []
+    for base in _bases:
+        _lowest_point = base[:, 2].min()
+
+        if len(base) < 4:
+            _bottoms.append(base[base[:, 2] == _lowest_point])
+        else:
+            _bottoms.append(np.append(next(_centroids), _lowest_point))
+    return _bottoms
+
+
+def _cluster_top(cluster: ndarray,
+                 tolerance: float = 2) -> Union[ndarray, None]:
+    """Highest points of a cluster, or None when its window is empty"""
+    with span("window", len(cluster)) as _span:
+        _highest_height = cluster[:, 2].max()
+        _points_in_window = cluster[cluster[:, 2] > _highest_height - tolerance]
+        _span.points_out = len(_points_in_window)
+    if len(_points_in_window) == 0:
+        return None
+    _highest_z = _points_in_window[:, 2].max()
+    return _points_in_window[_points_in_window[:, 2] == _highest_z]
+
+
+def _cluster_hull(cluster: ndarray,
+                  alpha: float = 0.3):
+    """Concave hull of a cluster, simplified later with every other hull"""
+    with span("hull", len(cluster)) as _span:
+        _concave_hull, _ = alpha_shape(points=cluster, alpha=alpha)
+        _span.points_out = int(shapely.get_num_coordinates(_concave_hull))
+    return _concave_hull
+
+
+def _group_or_whole(labels: ndarray) -> Tuple[ndarray, ndarray]:
+    """Cluster ranges of labels, or a single range over every point
+       when no cluster was found"""
+    _order, _bounds = group_labels(labels)
+    if len(_bounds) == 1:
+        return np.arange(len(labels)), np.array([0, len(labels)])
+    return _order, _bounds
+
+
+def _grid_thin_indices(data: PointData,
+                       cell_size: float,
+                       mode: str = "first",
+                       dims: int = 2,
+                       origin: Union[Sequence[float], None] = None) -> Tuple[ndarray, ndarray]:
+    """thin_indices on the stored coordinates of data, with the cell size
+       and origin moved onto their grid so quantized points are hashed
+       without being converted. The origin is rounded like the stored
+       values, so the lowest point starts the first cell as in memory."""
+    _scales = data.scales[:dims]
+    _origin = None if origin is None else data.quantize(np.asarray(origin, dtype=np.float64))[:dims]
+    return thin_indices(data["points"], cell_size / _scales, mode, dims, _origin)
+
+
+def _feature_table(classification: int,
+                   kind: str,
+                   per_cluster: List) -> ndarray:
+    """FEATURE_DTYPE rows of the points found for every cluster of a class.
+       A cluster may give several points (one per base, or tied tops) or
+       none."""
+    _parts, _clusters = [], []
+    for cluster, found in enumerate(per_cluster):
+        for points in (found if isinstance(found, list) else [found]):
+            if points is None:
+                continue
+            points = np.atleast_2d(points)
+            _parts.append(points)
+            _clusters.append(np.full(len(points), cluster, dtype=np.int64))
+
+    _points = np.vstack(_parts) if _parts else np.empty((0, 3))
+    table = np.empty(len(_points), dtype=FEATURE_DTYPE)
+    table["classification"] = classification
+    table["cluster"] = np.concatenate(_clusters) if _clusters else 0
+    table["kind"] = kind
+    table["x"], table["y"], table["z"] = _points[:, 0], _points[:, 1], _points[:, 2]
+    return table
+
+
+def _recorded(method: Callable) -> Callable:
+    """Runs a Cloud method inside a span of the cloud's recorder, so the
+       stages it goes through are recorded under the method's name"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.recorder.span(f"Cloud.{method.__name__}", getattr(self, "point_count", None)) as _span:
+            _result = method(self, *args, **kwargs)
+            if isinstance(_result, (list, ndarray)):
+                _span.points_out = len(_result)
+            return _result
+    return wrapper
 
 
 class Cloud:
     def __init__(self,
-                 file: Union[str, None]) -> None:
-
-        if file is not None:
-            logging.info("Reading points")
-
-            self.data = read(file)
-            self.points = self.data[:, [0, 1, 2]]
-            self.intensity = self.data[:, 3]
-            self.return_number = self.data[:, 4]
-            self.number_of_returns = self.data[:, 5]
-            self.scan_direction_flag = self.data[:, 6]
-            self.edge_of_flight_line = self.data[:, 7]
-            self.classification = self.data[:, 8]
-            self.synthetic = self.data[:, 9]
-            self.key_point = self.data[:, 10]
-            self.withheld = self.data[:, 11]
-            self.user_data = self.data[:, 12]
-            self.point_source_id = self.data[:, 13]
-            self.gps_time = self.data[:, 14]
-            self.unique_classes = np.unique(self.classification)
-            self.version = "1.4"
-            self.point_count = len(self.data)
+                 file: Union[str, None],
+                 stream: bool = False,
+                 chunk_size: int = DEFAULT_CHUNK_SIZE,
+                 cache: bool = False,
+                 cache_dir: Union[str, None] = None,
+                 instrument: bool = False,
+                 trace_memory: bool = False,
+                 callbacks: Union[List[Callable], None] = None,
+                 fields: Union[List[str], None] = None,
+                 classes: Union[List[int], None] = None,
+                 bbox: Union[Tuple[float, float, float, float], None] = None,
+                 coordinates: str = "float64") -> None:
+        """When stream is True the points are never loaded as a whole.
+           The file is read chunk_size points at a time by every call
+           that needs them, keeping memory use fixed.
+           When cache is True the decoded columns are saved next to the
+           file (or in cache_dir) and memory mapped on later opens.
+           With instrument every stage (read, class filter, clustering,
+           windowing, hulls, write) is timed into a span of self.recorder,
+           see report(). trace_memory adds the peak allocation of each
+           span and callbacks are called with every finished span.
+           fields limits the attributes decoded (points and classification
+           are always kept, left out attributes are None), classes and an
+           (xmin, ymin, xmax, ymax) bbox keep only matching points. The
+           filters are applied chunk by chunk while reading.
+           coordinates 'int32' keeps XYZ as the raw las integers and
+           'float32' as offsets from a local origin, half the memory of
+           'float64'. self.points then converts on access, grid steps
+           (thinning, box filters) run on the stored values. The cache
+           always holds float64 coordinates."""
+        self.recorder = Recorder(enabled=instrument, trace_memory=trace_memory, callbacks=callbacks)
+        self.file = file
+        self.stream = stream
+        self.chunk_size = chunk_size
+        _fields = None if fields is None else select_fields(list(fields) + ["classification"])
+        self._read_options = {"fields": _fields, "classes": classes, "bbox": bbox, "coordinates": coordinates}
+        # Class remaps not yet applied to the file when streaming
+        self._class_map = {}
+        self._spatial_index = None
+
+        with self.recorder.span("Cloud.open") as _span:
+            if file is not None and stream:
+                logging.info("Scanning points")
+
+                _unique_classes = set()
+                self.point_count = 0
+                for chunk in read_chunks(file, chunk_size=chunk_size, fields=("classification",),
+                                         classes=classes, bbox=bbox):
+                    _unique_classes.update(np.unique(chunk["classification"]).tolist())
+                    self.point_count += len(chunk)
+                self.unique_classes = np.array(sorted(_unique_classes), dtype=np.uint8)
+                self.version = "1.4"
+
+            elif file is not None and cache:
+                _data = load_cached(file, cache_dir)
+                if _data is None:
+                    _data = read(file, chunk_size=chunk_size)
+                    save_cache(file, _data, cache_dir)
+                # The cache holds the whole file, filtering the mapped columns is cheap
+                if classes is not None or bbox is not None:
+                    _mask = np.ones(len(_data), dtype=bool)
+                    if classes is not None:
+                        _mask &= np.isin(_data["classification"], classes)
+                    if bbox is not None:
+                        _mask &= _data.inside(bbox)
+                    _data = _data[_mask]
+                if _fields is not None:
+                    _data = PointData({name: _data[name] for name in _fields})
+                self.load_points(_data)
+
+            elif file is not None:
+                self.load_points(read(file, chunk_size=chunk_size, **self._read_options))
+            _span.points_out = getattr(self, "point_count", None)
 
     def load_points(self,
-                    data: ndarray,
-                    file: str) -> None:
+                    data: Union[PointData, None] = None,
+                    file: Union[str, None] = None) -> None:
+        """Loads points from typed columns, or reads them from file.
+           Every attribute is a zero-copy view of its column."""
         logging.info("Reading points")
 
-        self.data = read(las_file)
-        self.points = self.data[:, [0, 1, 2]]
-        self.intensity = self.data[:, 3]
-        self.return_number = self.data[:, 4]
-        self.number_of_returns = self.data[:, 5]
-        self.scan_direction_flag = self.data[:, 6]
-        self.edge_of_flight_line = self.data[:, 7]
-        self.classification = self.data[:, 8]
-        self.synthetic = self.data[:, 9]
-        self.key_point = self.data[:, 10]
-        self.withheld = self.data[:, 11]
-        self.user_data = self.data[:, 12]
-        self.point_source_id = self.data[:, 13]
-        self.gps_time = self.data[:, 14]
-        self.unique_classes = np.unique(self.classification)
+        if data is None:
+            data = read(file)
+        self.data = data
+        # One attribute per las field, None for fields that were not read
+        for name in LAS_ATTRIBUTES:
+            setattr(self, name, self.data.columns.get(name))
+        self.class_index = ClassIndex(self.classification)
+        self.unique_classes = self.class_index.classes
         self.version = "1.4"
         self.point_count = len(self.data)
+        self._spatial_index = None
+
+    @property
+    def points(self) -> ndarray:
+        """Real float64 XYZ of every point, the points column itself unless
+           the coordinates are quantized"""
+        if self.stream:
+            raise StreamError("A streamed cloud never holds all of its points, open the cloud without stream")
+        return self.data.xyz()
+
+    @property
+    def spatial_index(self) -> SpatialIndex:
+        """XY grid index over the points, built on first use and kept
+           for every later query"""
+        if self.stream:
+            raise StreamError("A streamed cloud has no spatial index, open the cloud without stream")
+        if self._spatial_index is None:
+            logging.info("Building spatial index")
+            # Built on the stored coordinates, quantized points are not converted
+            self._spatial_index = SpatialIndex(self.data["points"], scales=self.data.scales, offsets=self.data.offsets)
+        return self._spatial_index
+
+    def _points_of_class(self,
+                         classification: int,
+                         bbox: Union[Tuple[float, float, float, float], None] = None) -> ndarray:
+        """Points of a class, limited to an (xmin, ymin, xmax, ymax) box if
+           given. A streamed cloud reads them chunk by chunk."""
+        if self.stream:
+            return self._points_by_class([classification], bbox)[classification]
+        with span("class_filter", self.point_count) as _span:
+            if bbox is None:
+                _points = self.data.xyz(self.class_index.indices(classification))
+            else:
+                _indices = self.spatial_index.bbox(*bbox)
+                _points = self.data.xyz(_indices[self.classification[_indices] == classification])
+            _span.points_out = len(_points)
+        return _points
 
     def view(self,
              points: ndarray = None) -> None:
@@ -76,115 +306,184 @@ class Cloud:
         else:
             v = pptk.viewer(points)
 
+    def chunks(self) -> Iterator[PointData]:
+        """Yields the cloud in chunks of typed columns. In streaming mode any
+           pending class conversions are applied to each chunk as it is read."""
+        if not self.stream:
+            for start in range(0, self.point_count, self.chunk_size):
+                yield self.data[start:start + self.chunk_size]
+            return
+
+        for chunk in read_chunks(self.file, chunk_size=self.chunk_size, **self._read_options):
+            if self._class_map:
+                _classes = chunk["classification"]
+                _remapped = _classes.copy()
+                for classification, new_class in self._class_map.items():
+                    _remapped[_classes == classification] = new_class
+                chunk["classification"] = _remapped
+            yield chunk
+
     def points_in_class(self,
-                        classification: int) -> ndarray:
+                        classification: int) -> PointData:
         """Returns all points of a corresponding class"""
 
-        _points_in_class = self.data[self.classification == classification]
+        if self.stream:
+            return PointData.concatenate(chunk[chunk["classification"] == classification]
+                                         for chunk in self.chunks())
+
+        _points_in_class = self.data[self.class_index.indices(classification)]
         return _points_in_class
 
-    def _draw_shapely_polygons(self,
-                               poly: Polygon,
-                               acad: Autocad):
-        print(poly, end="\r")
-        _x, _y = poly.exterior.xy
-        _xy = np.empty((len(_x), 2))
-        _xy[:, 0] = _x
-        _xy[:, 1] = _y
-        for key, coord in enumerate(_xy):
-            if key == len(_xy) - 1:
-                _draw_to = _xy[0]
-                p1 = APoint(coord[0], coord[1])
-                p2 = APoint(_draw_to[0], _draw_to[1])
+    def class_counts(self) -> dict:
+        """Number of points of every class in the cloud"""
+        if self.stream:
+            _counts = np.zeros(256, dtype=np.int64)
+            for chunk in self.chunks():
+                _counts += np.bincount(chunk["classification"], minlength=256)
+            return {int(c): int(_counts[c]) for c in np.flatnonzero(_counts)}
+
+        return self.class_index.histogram()
+
+    @_recorded
+    def thin(self,
+             cell_size: float,
+             mode: str = "first",
+             voxel: bool = False) -> "Cloud":
+        """New cloud keeping one point per XY cell (or XYZ voxel) of
+           cell_size: the first point of the cell, its lowest or highest
+           point, or with 'centroid' the first point moved to the mean of
+           the cell. When streaming, chunks are thinned one at a time on a
+           grid anchored at the file's minimum and the survivors are thinned
+           once more, so the result matches a thinning in memory."""
+        _dims = 3 if voxel else 2
+        if not self.stream:
+            if mode == "centroid":
+                # The first point of every cell moved to the mean of the cell
+                _first, _inverse = _grid_thin_indices(self.data, cell_size, "first", _dims)
+                _data = self.data[_first]
+                _data["points"] = _data.quantize(cell_means(self.points, _inverse, len(_first)))
             else:
-                _draw_to = _xy[key + 1]
-                p1 = APoint(coord[0], coord[1])
-                p2 = APoint(_draw_to[0], _draw_to[1])
-            acad.model.AddLine(p1, p2)
+                _data = self.data[_grid_thin_indices(self.data, cell_size, mode, _dims)[0]]
+        else:
+            if mode == "centroid":
+                raise ThinningError("Centroid thinning needs the points in memory, open the cloud without stream")
+            with laspy.open(self.file) as fh:
+                _origin = fh.header.mins
+            _kept = PointData.concatenate(chunk[_grid_thin_indices(chunk, cell_size, mode, _dims, _origin)[0]]
+                                          for chunk in self.chunks())
+            _data = _kept[_grid_thin_indices(_kept, cell_size, mode, _dims, _origin)[0]]
+
+        cloud = Cloud(None)
+        cloud.load_points(_data)
+        return cloud
+
+    @_recorded
     def draw_polygons(self,
-                      data: ndarray,
+                      data: Union[ndarray, None] = None,
                       alpha: float = 0.3,
-                      tolerance: float = 0.5) -> None:
-        logging.info("Clustering points")
-        _points: ndarray = data[::5]
-        _clusters: List = dbscan(points=_points, eps=10)
-        _hulls: List = []
-        logging.info("Finding polygons")
-
-        for key, cluster in enumerate(_clusters):
-            print(f"({key}/{len(_clusters)})", end="\r")
-            _concave_hull, _ = alpha_shape(points=cluster, alpha=alpha)
-            _concave_hull = _concave_hull.simplify(tolerance=tolerance)
-            _hulls.append(_concave_hull)
+                      tolerance: float = 0.5,
+                      bbox: Union[Tuple[float, float, float, float], None] = None,
+                      executor: str = "serial",
+                      workers: Union[int, None] = None,
+                      output: Union[str, HullSink, None] = None,
+                      cell_size: Union[float, None] = None,
+                      label_cache: Union[bool, str] = False,
+                      merge: bool = True) -> List:
+        """Finds the concave hull of every cluster and writes the hulls to
+           output, a .dxf or .geojson path or a HullSink. Without output the
+           hulls are drawn into a running AutoCAD session.
+           Per-cluster hulls run on the given executor ('serial', 'thread'
+           or 'process') with up to workers workers, results stay in
+           cluster order.
+           With cell_size the points are thinned to one centroid per XY
+           cell of that size before clustering, otherwise every fifth
+           point is kept.
+           With label_cache the dbscan labels are reused from the label
+           cache (True for the default folder, or a folder path).
+           A streamed cloud needs data, its points are never loaded whole.
+           The hulls are simplified in one batch and, with merge, hulls
+           that overlap or touch are joined into one."""
+        if data is None:
+            data = self.points if bbox is None else self.data.xyz(self.spatial_index.bbox(*bbox))
 
+        logging.info("Clustering points")
+        _points: ndarray = data[::5] if cell_size is None else thin(data, cell_size, mode="centroid")[0]
+        _order, _bounds = group_labels(dbscan(points=_points, eps=10, return_labels=True, cache=label_cache))
 
-        acad = Autocad()
-        acad.prompt("Hello, Autocad from Python\n")
-
-        logging.info("Drawing polys to CAD")
-        for key, hull in enumerate(_hulls):
-            print(f"({key}/{len(_hulls)})", end="\r")
-            if type(hull) is MultiPolygon:
-                pass
-            else:
-                self._draw_shapely_polygons(hull, acad)
-
-        sys.exit()
-
-
-        plt.plot(_points[:, 0], _points[:, 1], 'b.')
-
-        for hull in _hulls:
-            if type(hull) is MultiPolygon:
-                for geom in hull.geoms:
-                    _x, _y = geom.exterior.xy
-                    plt.plot(_x, _y, 'r-')
-            else:
-                _x, _y = hull.exterior.xy
-                print(type(_x[1]))
-                plt.plot(_x, _y, 'r-')
-
-        plt.show()
-        sys.exit()
+        logging.info("Finding polygons")
+        _hulls: List = map_clusters(_cluster_hull, _points, _order, _bounds,
+                                    executor=executor, workers=workers,
+                                    alpha=alpha)
+        _hulls = simplify_hulls(_hulls, tolerance)
+        if merge:
+            _hulls = merge_hulls(_hulls)
+        _hulls = list(_hulls)
+
+        logging.info("Writing polygons")
+        with open_sink(output) as sink:
+            for hull in _hulls:
+                sink.write(hull)
+
+        return _hulls
+
+    def bounds(self) -> Tuple[float, float, float, float]:
+        """XY extent (xmin, ymin, xmax, ymax), from the header when streaming"""
+        if self.stream:
+            with laspy.open(self.file) as fh:
+                _mins, _maxs = fh.header.mins, fh.header.maxs
+        else:
+            # Extremes of the stored values, the mapping to real coordinates keeps their order
+            _raw = self.data["points"]
+            _mins = _raw.min(axis=0) * self.data.scales + self.data.offsets
+            _maxs = _raw.max(axis=0) * self.data.scales + self.data.offsets
+        return float(_mins[0]), float(_mins[1]), float(_maxs[0]), float(_maxs[1])
+
+    @_recorded
+    def rasterize(self,
+                  cell_size: float = 1.0,
+                  classes: Union[List[int], None] = None,
+                  return_numbers: Union[List[int], None] = None,
+                  bounds: Union[Tuple[float, float, float, float], None] = None) -> Raster:
+        """Min, max, mean and count grids of the point heights, optionally
+           only of some classes and return numbers. Works one chunk at a
+           time, so a streamed cloud is never loaded as a whole."""
+        _bounds = self.bounds() if bounds is None else bounds
+        return rasterize(self.chunks(), _bounds, cell_size, classes=classes, return_numbers=return_numbers)
+
+    def ground_model(self,
+                     cell_size: float = 1.0,
+                     classification: int = 2) -> GroundModel:
+        """Terrain heights from the lowest point of a ground class per cell"""
+        if classification not in self.unique_classes:
+            raise InvalidClassError("Class not found in data")
+        return GroundModel(self.rasterize(cell_size, classes=[classification]))
 
+    @_recorded
     def find_bottoms(self,
                      classification: int,
-                     write_to_file: bool = False) -> ndarray:
-        def points_in_window(tolerance: int,
-                             points: ndarray) -> ndarray:
-            _lowest_height = min(points[:, 2])
-            _points_in_window = points[points[:, 2] < _lowest_height + tolerance]
-            return _points_in_window
-
+                     write_to_file: bool = False,
+                     bbox: Union[Tuple[float, float, float, float], None] = None,
+                     executor: str = "serial",
+                     workers: Union[int, None] = None,
+                     ground: Union[GroundModel, None] = None,
+                     label_cache: Union[bool, str] = False) -> ndarray:
+        """Bottom points of every cluster of a class. With a ground model
+           (see ground_model) bases are searched within the tolerance of the
+           terrain rather than of each cluster's lowest point. label_cache
+           reuses the dbscan labels as in draw_polygons. An empty (0, 3)
+           array when no point of the class is inside bbox."""
         logging.info("Finding bottoms")
 
         if classification in self.unique_classes:
-            _points = self.points[self.classification == classification]
-            _clusters = dbscan(_points)
-
-            if len(_clusters) == 0:
-                _clusters = [_points]
-
-            _bottoms = []
-            _bar = _clusters
-            for cluster in _clusters:
-                """Finding our lowest point and then finding all points within a tolerance"""
-                _points_in_window = points_in_window(points=cluster, tolerance=5)
-
-                _bases = cubic_clustering(_points_in_window, 2)
-                for base in _bases:
-                    base = np.vstack(base)
-                    _lowest_point = min(base[:, 2])
-
-                    if len(base) < 4:
-                        _bottoms.append(base[base[:, 2] ==_lowest_point])
-                    else:
-                        _poly = Polygon(base)
-                        _centroid = _poly.centroid
-                        _bottom = np.array([_centroid.x, _centroid.y, _lowest_point])
-                        _bottoms.append(_bottom)
-
-            _bottoms = np.vstack(_bottoms)
+            _points = self._points_of_class(classification, bbox)
+            if len(_points) == 0:
+                _bottoms = np.empty((0, 3))
+            else:
+                _order, _bounds = _group_or_whole(dbscan(_points, return_labels=True, cache=label_cache))
+                _per_cluster = map_clusters(_cluster_bottoms, _points, _order, _bounds,
+                                            executor=executor, workers=workers,
+                                            tolerance=5, length=2, ground=ground)
+                _bottoms = np.vstack([bottom for bottoms in _per_cluster for bottom in bottoms])
 
             if write_to_file:
                 with open("bottoms.txt", "w") as f:
@@ -196,35 +495,29 @@ class Cloud:
         else:
             raise InvalidClassError("Class not found in data")
 
+    @_recorded
     def find_single_tops(self,
                          classification: int,
-                         write_to_file: bool = False) -> ndarray:
-        def points_in_window(tolerance: int,
-                             points: ndarray) -> ndarray:
-            _highest_height = max(points[:, 2])
-            _points_in_window = points[points[:, 2] > _highest_height - tolerance]
-            return _points_in_window
-
+                         write_to_file: bool = False,
+                         bbox: Union[Tuple[float, float, float, float], None] = None,
+                         executor: str = "serial",
+                         workers: Union[int, None] = None,
+                         label_cache: Union[bool, str] = False) -> ndarray:
+        """Highest points of every cluster of a class. label_cache reuses
+           the dbscan labels as in draw_polygons. An empty (0, 3) array
+           when no point of the class is inside bbox."""
         logging.info("Finding tops")
 
         if classification in self.unique_classes:
-            _points = self.points[self.classification == classification]
-            _clusters = sk_dbscan(_points, plot=True)
-
-            if len(_clusters) == 0:
-                _clusters = [_points]
-
-            _tops = []
-            _bar = _clusters
-            for cluster in _clusters:
-                """Finding our lowest point and then finding all points within a tolerance"""
-                _points_in_window = points_in_window(points=cluster, tolerance=2)
-                if len(_points_in_window) > 0:
-                    _highest_z = max(_points_in_window[:, 2])
-                    _top = _points_in_window[_points_in_window[:, 2] == _highest_z]
-                    _tops.append(_top)
-
-            _tops = np.vstack(_tops)
+            _points = self._points_of_class(classification, bbox)
+            if len(_points) == 0:
+                _tops = np.empty((0, 3))
+            else:
+                _order, _bounds = _group_or_whole(sk_dbscan(_points, return_labels=True, cache=label_cache))
+                _per_cluster = map_clusters(_cluster_top, _points, _order, _bounds,
+                                            executor=executor, workers=workers,
+                                            tolerance=2)
+                _tops = np.vstack([top for top in _per_cluster if top is not None])
 
             if write_to_file:
                 with open("tops.txt", "w") as f:
@@ -236,15 +529,184 @@ class Cloud:
         else:
             raise InvalidClassError("Class not found in data")
 
+    def _points_by_class(self,
+                         classes: Sequence[int],
+                         bbox: Union[Tuple[float, float, float, float], None] = None) -> Dict[int, ndarray]:
+        """Points of every class in classes from a single pass. In memory
+           the class index gives each class without a scan, when streaming
+           one read of the file sorts every chunk into its class."""
+        with span("class_filter", self.point_count) as _span:
+            if not self.stream:
+                if bbox is None:
+                    _groups = {c: self.data.xyz(self.class_index.indices(c)) for c in classes}
+                else:
+                    _indices = self.spatial_index.bbox(*bbox)
+                    _classification = self.classification[_indices]
+                    _groups = {c: self.data.xyz(_indices[_classification == c]) for c in classes}
+            else:
+                _parts = {c: [] for c in classes}
+                for chunk in self.chunks():
+                    if bbox is not None:
+                        chunk = chunk[chunk.inside(bbox)]
+                    _points, _classification = chunk.xyz(), chunk["classification"]
+                    # Grouping the chunk by class once instead of masking it per class
+                    _order = np.argsort(_classification, kind="stable")
+                    _bounds = np.searchsorted(_classification[_order], [(c, c + 1) for c in classes])
+                    for c, (start, stop) in zip(classes, _bounds):
+                        _parts[c].append(_points[_order[start:stop]])
+                _groups = {c: np.vstack(parts) if parts else np.empty((0, 3)) for c, parts in _parts.items()}
+            _span.points_out = sum(len(points) for points in _groups.values())
+        return _groups
+
+    @staticmethod
+    def _cluster_groups(points: ndarray,
+                        clustering: str,
+                        label_cache: Union[bool, str],
+                        groups: Dict[str, Tuple[ndarray, ndarray]]) -> Tuple[ndarray, ndarray]:
+        """Cluster ranges of points for a clustering method, computed once
+           and kept in groups for the other kinds of the same class"""
+        if clustering not in groups:
+            _labels = CLUSTERERS[clustering](points, return_labels=True, cache=label_cache)
+            groups[clustering] = _group_or_whole(_labels)
+        return groups[clustering]
+
+    @_recorded
+    def extract(self,
+                classes: Sequence[int],
+                kinds: Sequence[str] = FEATURE_KINDS,
+                clustering: Union[str, None] = None,
+                bbox: Union[Tuple[float, float, float, float], None] = None,
+                executor: str = "serial",
+                workers: Union[int, None] = None,
+                ground: Union[GroundModel, None] = None,
+                label_cache: Union[bool, str] = False,
+                output: Union[str, None] = None) -> ndarray:
+        """Bottoms and/or tops of every cluster of several classes at once.
+           The points are split by class in one pass. Each kind is found on
+           the clustering of KIND_CLUSTERING, the one find_bottoms and
+           find_single_tops use, unless clustering names one for every
+           kind. A class is clustered once per clustering method. Returns one FEATURE_DTYPE table (class, cluster id
+           within the class, kind, x, y, z), also written as csv to output
+           when given."""
+        _unknown = set(kinds) - set(FEATURE_KINDS)
+        if _unknown:
+            raise ExtractionError(f"Feature kinds must be in {FEATURE_KINDS}")
+        if clustering is not None and clustering not in CLUSTERERS:
+            raise ExtractionError(f"Clustering must be one of {tuple(CLUSTERERS)}")
+        _missing = [c for c in classes if c not in self.unique_classes]
+        if _missing:
+            raise InvalidClassError(f"Classes {_missing} not found in data")
+
+        logging.info(f"Extracting {', '.join(kinds)} of classes {list(classes)}")
+        _tables = []
+        for classification, points in self._points_by_class(classes, bbox).items():
+            if len(points) == 0:
+                continue
+            _groups = {}
+            if "bottoms" in kinds:
+                _order, _bounds = self._cluster_groups(points, clustering or KIND_CLUSTERING["bottoms"],
+                                                       label_cache, _groups)
+                _per_cluster = map_clusters(_cluster_bottoms, points, _order, _bounds,
+                                            executor=executor, workers=workers,
+                                            tolerance=5, length=2, ground=ground)
+                _tables.append(_feature_table(classification, "bottoms", _per_cluster))
+            if "tops" in kinds:
+                _order, _bounds = self._cluster_groups(points, clustering or KIND_CLUSTERING["tops"],
+                                                       label_cache, _groups)
+                _per_cluster = map_clusters(_cluster_top, points, _order, _bounds,
+                                            executor=executor, workers=workers,
+                                            tolerance=2)
+                _tables.append(_feature_table(classification, "tops", _per_cluster))
+
+        table = np.concatenate(_tables) if _tables else np.empty(0, dtype=FEATURE_DTYPE)
+        if output is not None:
+            np.savetxt(output, table, fmt=("%d", "%d", "%s", "%.6f", "%.6f", "%.6f"), delimiter=",",
+                       header=",".join(FEATURE_DTYPE.names), comments="")
+            logging.info(f"{len(table)} features written to {output}")
+        return table
+
+    @_recorded
+    def geometric_features(self,
+                           k: int = 16,
+                           radius: Union[float, None] = None,
+                           classification: Union[int, None] = None,
+                           executor: str = "serial",
+                           workers: Union[int, None] = None) -> ndarray:
+        """Covariance features (linearity, planarity, scattering,
+           verticality, normal) of every point, see features.py. With a
+           classification only that class is used, both as the points
+           described and as their neighbours, and rows follow
+           class_index.indices(classification)."""
+        if self.stream:
+            raise ExtractionError("Geometric features need the points in memory, open the cloud without stream")
+        if classification is None:
+            _points = self.points
+        elif classification in self.unique_classes:
+            _points = self.data.xyz(self.class_index.indices(classification))
+        else:
+            raise InvalidClassError("Class not found in data")
+        return geometric_features(_points, k=k, radius=radius, executor=executor, workers=workers)
+
     def convert_class(self,
                       classification: int,
                       new_class: int) -> None:
         if classification in self.unique_classes:
-            self.data[:, 8][self.data[:, 8] == classification] = new_class
-            self.unique_classes = np.unique(self.data[:, 8])
+            if self.stream:
+                # Chaining onto earlier remaps so a -> b -> c maps a to c
+                for key, value in self._class_map.items():
+                    if value == classification:
+                        self._class_map[key] = new_class
+                self._class_map[classification] = new_class
+                _unique_classes = set(self.unique_classes.tolist())
+                _unique_classes.discard(classification)
+                _unique_classes.add(new_class)
+                self.unique_classes = np.array(sorted(_unique_classes), dtype=np.uint8)
+            else:
+                self.classification[self.class_index.indices(classification)] = new_class
+                self.class_index.remap(classification, new_class)
+                self.unique_classes = self.class_index.classes
         else:
             raise InvalidClassError("Class not found in data")
 
+    @_recorded
+    def write(self,
+              filename: str = "default",
+              path: Union[str, None] = None,
+              point_format: Union[int, None] = None,
+              laz: bool = False,
+              laz_backend: Union[str, None] = None) -> None:
+        """Writes the cloud to a las (or laz) file using the cloud's
+           version, one chunk at a time. point_format defaults to the
+           source file's, or to 6 (3 for version 1.2) so classes above 31
+           fit in version 1.4."""
+        _path = os.getcwd() if path is None else path
+        _scales, _offsets = None, None
+        _point_format = 3 if self.version == "1.2" else 6
+        if self.file is not None:
+            with laspy.open(self.file) as fh:
+                _scales, _offsets = fh.header.scales, fh.header.offsets
+                # Formats 6 and up need version 1.4
+                if self.version != "1.2" or fh.header.point_format.id <= 5:
+                    _point_format = fh.header.point_format.id
+        elif self.data["points"].dtype == np.int32:
+            _scales, _offsets = self.data.scales, self.data.offsets
+        if point_format is None:
+            point_format = _point_format
+
+        write_chunks(self.chunks(),
+                     point_format=point_format,
+                     version=self.version,
+                     filename=filename,
+                     path=_path,
+                     scales=_scales,
+                     offsets=_offsets,
+                     laz=laz,
+                     laz_backend=laz_backend)
+
+    def report(self) -> List[dict]:
+        """Spans recorded so far (empty unless the cloud is instrumented)"""
+        return self.recorder.report()
+
     def update_version(self,
                        version: str) -> None:
         _version_list = ["1.2", "1.4", "1.6"]
@@ -255,7 +717,7 @@ class Cloud:
 
 
 if __name__ == "__main__":
-    import os
+    logging.basicConfig(level=logging.INFO)
 
     file = f"D:\\Projects\\Dominion TL 539\\review\\dist_poles.las"
     cld = Cloud(file)
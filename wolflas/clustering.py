@@ -1,16 +1,22 @@
-import matplotlib.pyplot as plt
-import open3d as o3d
 import numpy as np
 import logging
-import time
 
-from typing import List
-from sklearn.cluster import DBSCAN
-from shapely import Polygon, MultiPolygon, Point
-from shapely.ops import unary_union
+from typing import Callable, List, Tuple, Union
 from numpy import ndarray
-from scipy.spatial.distance import cdist
+from wolflas.parallel import map_tasks
+from wolflas.instrumentation import span
+from wolflas.thinning import thin
+from wolflas.cache import labels_key, load_labels, save_labels
 from wolflas.exceptions import ScanError
+from wolflas.backends import lazy_module
+
+plt = lazy_module("matplotlib.pyplot")
+o3d = lazy_module("open3d")
+sklearn_cluster = lazy_module("sklearn.cluster")
+shapely = lazy_module("shapely")
+scipy_spatial = lazy_module("scipy.spatial")
+scipy_sparse = lazy_module("scipy.sparse")
+csgraph = lazy_module("scipy.sparse.csgraph")
 
 
 
@@ -18,49 +24,108 @@ from wolflas.exceptions import ScanError
     using o3d's dbscan.'''
 
 
-logging.basicConfig(level=logging.INFO)
+def group_labels(labels: ndarray) -> Tuple[ndarray, ndarray]:
+    """Groups point indices by cluster label with one stable sort.
+       The indices of cluster i are order[bounds[i]:bounds[i + 1]],
+       in their original order. Noise (label -1) is left out."""
+    labels = np.asarray(labels)
+    counts = np.bincount(labels + 1, minlength=1)
+    order = np.argsort(labels, kind="stable")[counts[0]:]
+    bounds = np.zeros(len(counts), dtype=np.int64)
+    np.cumsum(counts[1:], out=bounds[1:])
+    return order, bounds
+
+
+def split_clusters(points: ndarray,
+                   labels: ndarray) -> List:
+    """Splits points into one array per cluster label. The points are
+       gathered once and every cluster is a view into that gather."""
+    order, bounds = group_labels(labels)
+    if len(bounds) == 1:
+        return []
+    return np.split(points[order], bounds[1:-1])
+
+
+def _on_thinned(func,
+                points: ndarray,
+                cell_size: float,
+                dims: int,
+                return_labels: bool,
+                **kwargs) -> Union[List, ndarray]:
+    """Runs a clustering function on the cell centroids of points and
+       carries the labels back to every point through the cell inverse"""
+    _thinned, _inverse = thin(points, cell_size, mode="centroid", dims=dims)
+    labels = func(_thinned, return_labels=True, **kwargs)[_inverse]
+    if return_labels:
+        return labels
+    return split_clusters(points, labels)
+
+
+def _cached_labels(compute: Callable[[], ndarray],
+                   points: ndarray,
+                   cache: Union[bool, str],
+                   **params) -> ndarray:
+    """Labels of points from the label cache, computed and stored on a
+       miss. cache is False (off), True (default folder) or a folder."""
+    if not cache:
+        return compute()
+    _cache_dir = cache if isinstance(cache, str) else None
+    _key = labels_key(points, **params)
+    labels = load_labels(_key, _cache_dir)
+    if labels is None:
+        labels = compute()
+        save_labels(_key, labels, _cache_dir)
+    return labels
 
 
 def dbscan(points: ndarray,
            eps: float = 15,
            min_count: int = 15,
            print_progress: bool = False,
-           plot: bool = False) -> List:
+           plot: bool = False,
+           return_labels: bool = False,
+           cell_size: Union[float, None] = None,
+           cache: Union[bool, str] = False) -> Union[List, ndarray]:
     """The difference between 'log' and 'print_progress'
      is that 'log' is for the WolfLas print statements while
       'print_progress' is for the built-in log feature of o3d's
-      dbscan method"""
+      dbscan method.
+      With return_labels the raw label array (-1 for noise) is
+      returned instead of one array per cluster.
+      With cell_size the points are first thinned to one centroid per
+      voxel of that size, min_count then counts voxels.
+      With cache the labels are kept in the label cache (True for the
+      default folder, or a folder path) and reused for the same points
+      and parameters."""
+    if cell_size is not None:
+        return _on_thinned(dbscan, points, cell_size, 3, return_labels,
+                           eps=eps, min_count=min_count, print_progress=print_progress, cache=cache)
 
     logging.info("Performing dbscan")
-    # Our list for the clusters
-    clusters = []
-
-    pcd_points = points
-    pcd = o3d.geometry.PointCloud()
-    pcd.points = o3d.utility.Vector3dVector(pcd_points)
-
-    logging.info("Extracting labels")
-    try:
-        labels = np.array(pcd.cluster_dbscan(eps=eps, min_points=min_count, print_progress=print_progress))
-    except Exception:
-        raise ScanError("Dbscan failed. Try using different eps or min_count params")
-
-    num_of_clusters = int(labels.max())
-    labeled_points = np.empty((len(labels), 4), dtype=np.float64)
-    labeled_points[:, 0] = labels
-    labeled_points[:, 1] = pcd_points[:, 0]
-    labeled_points[:, 2] = pcd_points[:, 1]
-    labeled_points[:, 3] = pcd_points[:, 2]
 
-    logging.info("Clustering points")
+    # Vector3dVector copies float64 (n, 3) C-ordered input in one block,
+    # anything else (quantized or strided points) is converted here once
+    pcd_points = np.ascontiguousarray(points, dtype=np.float64)
+
+    def compute() -> ndarray:
+        pcd = o3d.geometry.PointCloud()
+        pcd.points = o3d.utility.Vector3dVector(pcd_points)
+
+        logging.info("Extracting labels")
+        try:
+            return np.array(pcd.cluster_dbscan(eps=eps, min_points=min_count, print_progress=print_progress))
+        except Exception:
+            raise ScanError("Dbscan failed. Try using different eps or min_count params")
+
+    with span("dbscan", len(points)) as _span:
+        labels = _cached_labels(compute, points, cache, backend="open3d", eps=eps, min_count=min_count)
+        _span.points_out = int(np.count_nonzero(labels >= 0))
 
-    for i in range(num_of_clusters):
-        print(f"({i}/{num_of_clusters})", end="\r")
-        cluster = labeled_points[labeled_points[:, 0] == i]
-        # Discarding the label
-        cluster = cluster[:, [1, 2, 3]]
-        clusters.append(cluster)
+    if return_labels:
+        return labels
 
+    logging.info("Clustering points")
+    clusters = split_clusters(pcd_points, labels)
 
     if plot:
         for cluster in clusters:
@@ -73,23 +138,30 @@ def dbscan(points: ndarray,
 def sk_dbscan(points: ndarray,
               eps: float = 15,
               min_count: int = 15,
-              plot: bool = False):
+              plot: bool = False,
+              return_labels: bool = False,
+              cell_size: Union[float, None] = None,
+              cache: Union[bool, str] = False) -> Union[List, ndarray]:
+    """DBSCAN over XY. With cell_size the points are first thinned to
+       one centroid per grid cell of that size. cache works as in dbscan."""
+    if cell_size is not None:
+        return _on_thinned(sk_dbscan, points, cell_size, 2, return_labels,
+                           eps=eps, min_count=min_count, cache=cache)
+
     flattened_points = points[:, [0, 1]]
-    clustering = DBSCAN(eps=eps, min_samples=min_count).fit(flattened_points)
-    labels = clustering.labels_
-    print(labels)
-    labels_max = max(labels)
-    labeled_points = np.empty((len(labels), 4), dtype=np.float64)
-    labeled_points[:, 0] = labels
-    labeled_points[:, 1] = points[:, 0]
-    labeled_points[:, 2] = points[:, 1]
-    labeled_points[:, 3] = points[:, 2]
-    clusters = []
-
-    for i in range(labels_max):
-        cluster = labeled_points[labeled_points[:, 0] == i]
-        cluster = cluster[:, [1, 2, 3]]
-        clusters.append(cluster)
+
+    def compute() -> ndarray:
+        return sklearn_cluster.DBSCAN(eps=eps, min_samples=min_count).fit(flattened_points).labels_
+
+    with span("sk_dbscan", len(points)) as _span:
+        # Only XY is clustered, so only XY goes into the key
+        labels = _cached_labels(compute, flattened_points, cache, backend="sklearn", eps=eps, min_count=min_count)
+        _span.points_out = int(np.count_nonzero(labels >= 0))
+
+    if return_labels:
+        return labels
+
+    clusters = split_clusters(points, labels)
 
     if plot:
         for cluster in clusters:
@@ -99,20 +171,151 @@ def sk_dbscan(points: ndarray,
     return clusters
 
 
-
-
-
+def _dbscan_tile(coords: ndarray,
+                 ids: ndarray,
+                 owned: ndarray,
+                 trusted: ndarray,
+                 eps: float,
+                 min_count: int) -> Tuple[ndarray, ndarray, ndarray, ndarray, ndarray]:
+    """DBSCAN links of one tile. coords holds the tile plus a halo of
+       2 * eps, trusted marks points within eps of the tile whose
+       neighbourhood (and so core status) is complete, owned marks the
+       points of the tile itself. Returns the owned core ids, the trusted
+       core ids with the id representing their local component, and
+       (border id, core id) pairs for owned border points."""
+    tree = scipy_spatial.cKDTree(coords)
+    core = np.zeros(len(coords), dtype=bool)
+    core[trusted] = tree.query_ball_point(coords[trusted], eps, return_length=True) >= min_count
+
+    core_ids = ids[core]
+    core_tree = scipy_spatial.cKDTree(coords[core])
+    pairs = core_tree.query_pairs(eps, output_type="ndarray")
+    graph = scipy_sparse.coo_matrix((np.ones(len(pairs), dtype=np.int8), (pairs[:, 0], pairs[:, 1])),
+                       shape=(len(core_ids), len(core_ids)))
+    _, components = csgraph.connected_components(graph, directed=False)
+    representatives = np.full(components.max() + 1 if len(components) > 0 else 0, -1, dtype=np.int64)
+    representatives[components[::-1]] = core_ids[::-1]
+
+    border = owned & ~core
+    neighbours = core_tree.query_ball_point(coords[border], eps)
+    lengths = np.array([len(n) for n in neighbours], dtype=np.int64)
+    border_ids = np.repeat(ids[border], lengths)
+    border_cores = core_ids[np.concatenate(neighbours).astype(np.int64)] if lengths.sum() > 0 \
+        else np.empty(0, dtype=np.int64)
+
+    return ids[core & owned], core_ids, representatives[components], border_ids, border_cores
+
+
+def tiled_dbscan(points: ndarray,
+                 eps: float = 15,
+                 min_count: int = 15,
+                 tile_size: float = 500.0,
+                 use_z: bool = False,
+                 executor: str = "process",
+                 workers: Union[int, None] = None,
+                 return_labels: bool = False,
+                 cell_size: Union[float, None] = None) -> Union[List, ndarray]:
+    """DBSCAN over XY tiles processed in parallel. Each tile is clustered
+       with a halo of 2 * eps around it and cluster ids are stitched across
+       tiles by merging components that share core points. Labels are the
+       same as a single sklearn DBSCAN run (sk_dbscan with use_z False),
+       while memory and time per task only follow the tile size.
+       With cell_size the points are first thinned to one centroid per
+       grid (or voxel with use_z) cell of that size.
+    """
+    if cell_size is not None:
+        return _on_thinned(tiled_dbscan, points, cell_size, 3 if use_z else 2, return_labels,
+                           eps=eps, min_count=min_count, tile_size=tile_size, use_z=use_z,
+                           executor=executor, workers=workers)
+
+    logging.info("Performing tiled dbscan")
+    coords = points[:, :3] if use_z else points[:, :2]
+    point_count = len(points)
+    if point_count == 0:
+        return np.empty(0, dtype=np.int64) if return_labels else []
+
+    # Tiles at least 2 * eps wide so a halo never reaches past the next tile
+    tile_size = max(tile_size, 2 * eps)
+    origin = coords[:, :2].min(axis=0)
+    tiles = np.floor((coords[:, :2] - origin) / tile_size).astype(np.int64)
+    width = int(tiles[:, 1].max()) + 1
+    tile_keys = tiles[:, 0] * width + tiles[:, 1]
+    order = np.argsort(tile_keys, kind="stable")
+    occupied, starts = np.unique(tile_keys[order], return_index=True)
+    ends = np.append(starts[1:], point_count)
+
+    def tasks():
+        for key, start, end in zip(occupied, starts, ends):
+            row, col = divmod(int(key), width)
+            lower = origin + np.array([row, col]) * tile_size
+            upper = lower + tile_size
+
+            # Gathering the tile and its eight neighbours, then cutting the halo
+            _neighbours = np.array([(row + dx) * width + col + dy
+                                    for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+                                    if 0 <= col + dy < width])
+            _positions = np.minimum(np.searchsorted(occupied, _neighbours), len(occupied) - 1)
+            _positions = _positions[occupied[_positions] == _neighbours]
+            _ids = np.concatenate([order[starts[p]:ends[p]] for p in _positions])
+            _xy = coords[_ids, :2]
+            _gap = np.max(np.maximum(lower - _xy, _xy - upper), axis=1)
+            _ids = _ids[_gap <= 2 * eps]
+            _gap = _gap[_gap <= 2 * eps]
+
+            _owned = np.zeros(len(_ids), dtype=bool)
+            _owned[np.isin(_ids, order[start:end])] = True
+            yield coords[_ids], _ids, _owned, _gap <= eps, eps, min_count
+
+    with span("tiled_dbscan", point_count) as _span:
+        core = np.zeros(point_count, dtype=bool)
+        link_rows, link_cols, border_ids, border_cores = [], [], [], []
+        for owned_cores, core_ids, representatives, tile_border_ids, tile_border_cores in \
+                map_tasks(_dbscan_tile, tasks(), executor=executor, workers=workers):
+            core[owned_cores] = True
+            link_rows.append(core_ids)
+            link_cols.append(representatives)
+            border_ids.append(tile_border_ids)
+            border_cores.append(tile_border_cores)
+
+        logging.info("Merging tiles")
+        link_rows = np.concatenate(link_rows)
+        link_cols = np.concatenate(link_cols)
+        graph = scipy_sparse.coo_matrix((np.ones(len(link_rows), dtype=np.int8), (link_rows, link_cols)),
+                           shape=(point_count, point_count))
+        _, components = csgraph.connected_components(graph, directed=False)
+
+        # Numbering clusters by their first core point, as sklearn does
+        core_ids = np.flatnonzero(core)
+        _, first = np.unique(components[core_ids], return_index=True)
+        cluster_of_component = np.full(components.max() + 1, -1, dtype=np.int64)
+        cluster_of_component[components[core_ids[np.sort(first)]]] = np.arange(len(first))
+
+        labels = np.full(point_count, -1, dtype=np.int64)
+        labels[core_ids] = cluster_of_component[components[core_ids]]
+
+        # Border points join the lowest numbered cluster next to them
+        border_ids = np.concatenate(border_ids)
+        border_labels = labels[np.concatenate(border_cores)]
+        border_best = np.full(point_count, np.iinfo(np.int64).max, dtype=np.int64)
+        np.minimum.at(border_best, border_ids, border_labels)
+        reached = border_best < np.iinfo(np.int64).max
+        labels[reached] = border_best[reached]
+        _span.points_out = int(np.count_nonzero(labels >= 0))
+
+    if return_labels:
+        return labels
+    return split_clusters(points, labels)
 
 
 def cubic_clustering(points: ndarray,
                      length: float = 1.00) -> List:
     """Rather slow but accurate way of clustering points into groups.
        Works well on smaller data sets. (Ex. finding individual bases
-       of a tower).
+       of a tower). See grid_clustering for a fast alternative.
     """
     squares = set()
 
-    def find_square(midpoint: ndarray) -> Polygon:
+    def find_square(midpoint: ndarray):
         """Finding square vertexes around given midpoint"""
         x = midpoint[0]
         y = midpoint[1]
@@ -122,34 +325,80 @@ def cubic_clustering(points: ndarray,
         v3 = [x-length, y]
         v4 = [x, y-length]
 
-        return Polygon((v1, v2, v3, v4))
+        return shapely.Polygon((v1, v2, v3, v4))
 
-    logging.info("Finding squares")
-    for point in points:
-        squares.add(find_square(point))
+    with span("cubic_clustering", len(points)) as _span:
+        logging.info("Finding squares")
+        for point in points:
+            squares.add(find_square(point))
 
-    logging.info("Merging squares")
-    merged_squares = unary_union(list(squares))
+        logging.info("Merging squares")
+        merged_squares = shapely.unary_union(list(squares))
 
-    clusters = []
+        clusters = []
 
-    if type(merged_squares) is MultiPolygon:
-        polys = set(merged_squares.geoms)
-        for p in polys:
-            clusters.append([c for c in points if p.contains(Point(c))])
-    else:
-        clusters.append([c for c in points if merged_squares.contains(Point(c))])
+        if type(merged_squares) is shapely.MultiPolygon:
+            polys = set(merged_squares.geoms)
+            for p in polys:
+                clusters.append([c for c in points if p.contains(shapely.Point(c))])
+        else:
+            clusters.append([c for c in points if merged_squares.contains(shapely.Point(c))])
+
+        _span.points_out = sum(len(cluster) for cluster in clusters)
 
     return clusters
 
 
+def grid_clustering(points: ndarray,
+                    length: float = 1.00,
+                    return_labels: bool = False) -> Union[List, ndarray]:
+    """Fast replacement for cubic_clustering. Points are hashed into square
+       XY cells of the given length and occupied cells touching each other
+       (sides or corners) are merged into one cluster. Returns a list of
+       point arrays like cubic_clustering, or with return_labels the cluster
+       label of every point.
+    """
+    if len(points) == 0:
+        return np.empty(0, dtype=np.int64) if return_labels else []
+
+    with span("grid_clustering", len(points)) as _span:
+        # Cell coordinates shifted by one so neighbour keys are never negative
+        cells = np.floor((points[:, :2] - points[:, :2].min(axis=0)) / length).astype(np.int64) + 1
+        width = int(cells[:, 1].max()) + 2
+        keys = cells[:, 0] * width + cells[:, 1]
+        occupied, inverse = np.unique(keys, return_inverse=True)
+
+        # Linking every occupied cell to its occupied neighbours. Half of the
+        # eight directions are enough as links are undirected
+        rows = []
+        cols = []
+        for dx, dy in ((0, 1), (1, -1), (1, 0), (1, 1)):
+            neighbours = occupied + dx * width + dy
+            positions = np.minimum(np.searchsorted(occupied, neighbours), len(occupied) - 1)
+            found = occupied[positions] == neighbours
+            rows.append(np.flatnonzero(found))
+            cols.append(positions[found])
+        rows = np.concatenate(rows)
+        cols = np.concatenate(cols)
+        graph = scipy_sparse.coo_matrix((np.ones(len(rows), dtype=np.int8), (rows, cols)),
+                           shape=(len(occupied), len(occupied)))
+        _, cell_labels = csgraph.connected_components(graph, directed=False)
+        labels = cell_labels[inverse.ravel()]
+        _span.points_out = len(labels)
+
+    if return_labels:
+        return labels
+
+    return split_clusters(points, labels)
+
+
 if __name__ == "__main__":
     import os
     from cloud import Cloud
 
+    logging.basicConfig(level=logging.INFO)
+
     file = f"{os.path.dirname(os.getcwd())}\\__data__\\buildings.las"
     cld = Cloud(file)
-    p = cld.points
-    p = p[::20]
-    dbscan(p)
+    dbscan(cld.points, cell_size=1.0)
 
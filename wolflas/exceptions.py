@@ -12,3 +12,36 @@ class ScanError(WolfLasError):
 
 class VersionError(WolfLasError):
     """Called when an incorrect las version is given"""
+
+
+class ExecutorError(WolfLasError):
+    """Called when an unknown executor is requested"""
+
+
+class BackendError(WolfLasError):
+    """Called when a requested backend is unknown or not installed"""
+
+
+class ExportError(WolfLasError):
+    """Called when hulls can't be written to the requested output"""
+
+
+class ThinningError(WolfLasError):
+    """Called when an unknown thinning mode is requested"""
+
+
+class RasterError(WolfLasError):
+    """Called when a grid can't be built or an unknown statistic is requested"""
+
+
+class FieldError(WolfLasError):
+    """Called when an unknown point field is requested"""
+
+
+class StreamError(WolfLasError):
+    """Called when a streamed cloud is asked for all of its points at once"""
+
+
+class ExtractionError(WolfLasError):
+    """Called when features can't be extracted as requested (ex. an unknown
+       feature kind or clustering method)"""
@@ -0,0 +1,161 @@
+import json
+import logging
+import os
+
+from abc import ABC, abstractmethod
+from typing import Iterator, Union
+from wolflas.exceptions import ExportError
+from wolflas.backends import lazy_module
+
+shapely = lazy_module("shapely")
+pyautocad = lazy_module("pyautocad")
+
+'''Output sinks for hull polygons. A sink is a context manager with a write
+    method taking one shapely geometry at a time, so hulls stream to their
+    destination in a single pass. Polygons with holes and multipart hulls
+    are written in full.'''
+
+
+def _polygons(geometry) -> Iterator:
+    """Every polygon part of a geometry"""
+    if isinstance(geometry, shapely.Polygon):
+        if not geometry.is_empty:
+            yield geometry
+    elif isinstance(geometry, (shapely.MultiPolygon, shapely.GeometryCollection)):
+        for part in geometry.geoms:
+            yield from _polygons(part)
+
+
+class HullSink(ABC):
+    """Base of every sink. Subclasses implement write_polygon, a sink
+       missing it can't be created."""
+
+    def __init__(self) -> None:
+        self.count = 0
+
+    def __enter__(self) -> "HullSink":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def write(self,
+              geometry) -> None:
+        for polygon in _polygons(geometry):
+            self.write_polygon(polygon)
+            self.count += 1
+
+    @abstractmethod
+    def write_polygon(self,
+                      polygon) -> None:
+        """Writes one polygon, holes included"""
+
+    def close(self) -> None:
+        pass
+
+
+class DxfSink(HullSink):
+    """Writes every ring as a closed 2D polyline of a plain DXF file. The file
+       has no header, so readers treat it as R12 and the rings are written as
+       R12 POLYLINE entities, which every DXF reader accepts."""
+
+    def __init__(self,
+                 path: str,
+                 layer: str = "0",
+                 precision: int = 4) -> None:
+        super().__init__()
+        self.path = path
+        self.layer = layer
+        self.precision = precision
+        self._fh = open(path, "w")
+        self._fh.write("0\nSECTION\n2\nENTITIES\n")
+
+    def _write_ring(self,
+                    ring) -> None:
+        _layer = self.layer
+        _p = self.precision
+        # Shapely rings repeat their first vertex, the closed flag replaces it
+        _vertices = "".join(f"0\nVERTEX\n8\n{_layer}\n10\n{x:.{_p}f}\n20\n{y:.{_p}f}\n30\n0.0\n"
+                            for x, y in shapely.get_coordinates(ring)[:-1].tolist())
+        self._fh.write(f"0\nPOLYLINE\n8\n{_layer}\n66\n1\n10\n0.0\n20\n0.0\n30\n0.0\n70\n1\n"
+                       f"{_vertices}0\nSEQEND\n8\n{_layer}\n")
+
+    def write_polygon(self,
+                      polygon) -> None:
+        self._write_ring(polygon.exterior)
+        for interior in polygon.interiors:
+            self._write_ring(interior)
+
+    def close(self) -> None:
+        if not self._fh.closed:
+            self._fh.write("0\nENDSEC\n0\nEOF\n")
+            self._fh.close()
+            logging.info(f"{self.count} polygons written to {self.path}")
+
+
+class GeoJsonSink(HullSink):
+    """Writes every polygon as a feature of a GeoJSON FeatureCollection"""
+
+    def __init__(self,
+                 path: str) -> None:
+        super().__init__()
+        self.path = path
+        self._fh = open(path, "w")
+        self._fh.write('{"type": "FeatureCollection", "features": [\n')
+
+    def write_polygon(self,
+                      polygon) -> None:
+        _separator = ",\n" if self.count > 0 else ""
+        _feature = {"type": "Feature", "properties": {"id": self.count}, "geometry": shapely.geometry.mapping(polygon)}
+        self._fh.write(_separator + json.dumps(_feature))
+
+    def close(self) -> None:
+        if not self._fh.closed:
+            self._fh.write("\n]}\n")
+            self._fh.close()
+            logging.info(f"{self.count} polygons written to {self.path}")
+
+
+class AutocadSink(HullSink):
+    """Draws every ring into a running AutoCAD session as one lightweight
+       polyline, a single COM call per ring instead of one per edge."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._acad = pyautocad.Autocad()
+        self._acad.prompt("Hello, Autocad from Python\n")
+
+    def _draw_ring(self,
+                   ring) -> None:
+        _flat = shapely.get_coordinates(ring)[:-1].ravel().tolist()
+        _polyline = self._acad.model.AddLightWeightPolyline(pyautocad.aDouble(*_flat))
+        _polyline.Closed = True
+
+    def write_polygon(self,
+                      polygon) -> None:
+        self._draw_ring(polygon.exterior)
+        for interior in polygon.interiors:
+            self._draw_ring(interior)
+
+
+SINKS = {".dxf": DxfSink,
+         ".geojson": GeoJsonSink,
+         ".json": GeoJsonSink}
+
+
+def open_sink(output: Union[str, HullSink, None] = None) -> HullSink:
+    """Sink for an output path (by its extension), an existing sink, or
+       AutoCAD when output is None"""
+    if output is None:
+        return AutocadSink()
+    if isinstance(output, HullSink):
+        return output
+
+    _extension = os.path.splitext(output)[1].lower()
+    if _extension not in SINKS:
+        raise ExportError(f"No hull sink for '{_extension}' files, use one of {tuple(SINKS)}")
+    return SINKS[_extension](output)
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,114 @@
+import numpy as np
+import logging
+
+from numpy import ndarray
+from typing import Union
+from wolflas.parallel import map_tasks
+from wolflas.instrumentation import span
+from wolflas.backends import lazy_module
+from wolflas.exceptions import ExecutorError
+
+scipy_spatial = lazy_module("scipy.spatial")
+
+'''Per point covariance features of a k nearest neighbour (or radius limited)
+    neighbourhood. Points are processed in chunks, each chunk gathers its
+    neighbourhoods as one (m, k, 3) block and solves every 3x3 covariance with
+    a single batched eigh, so memory follows the chunk size.'''
+
+# Points whose neighbourhoods are gathered at once
+DEFAULT_CHUNK_SIZE = 100_000
+
+GEOMETRY_DTYPE = np.dtype([("linearity", np.float32),
+                           ("planarity", np.float32),
+                           ("scattering", np.float32),
+                           ("verticality", np.float32),
+                           ("normal_x", np.float32),
+                           ("normal_y", np.float32),
+                           ("normal_z", np.float32),
+                           ("neighbours", np.uint16)])
+
+
+def _chunk_features(tree,
+                    points: ndarray,
+                    start: int,
+                    stop: int,
+                    k: int,
+                    radius: Union[float, None],
+                    query_workers: int = 1) -> ndarray:
+    """Features of points[start:stop] from their neighbourhoods in tree,
+       the neighbour query split over query_workers threads"""
+    _upper = np.inf if radius is None else radius
+    _, _neighbours = tree.query(points[start:stop], k=k, distance_upper_bound=_upper, workers=query_workers)
+    _neighbours = _neighbours.reshape(stop - start, k)
+
+    # Neighbours past the radius come back as index len(points)
+    _valid = _neighbours < len(points)
+    _counts = _valid.sum(axis=1)
+    _coords = points[np.where(_valid, _neighbours, 0)]
+    _weights = _valid[:, :, None].astype(np.float64)
+
+    _centroids = (_coords * _weights).sum(axis=1) / _counts[:, None]
+    _centered = (_coords - _centroids[:, None, :]) * _weights
+    _covariance = np.matmul(_centered.transpose(0, 2, 1), _centered) / _counts[:, None, None]
+
+    # eigh returns ascending eigenvalues, so l3 <= l2 <= l1
+    _values, _vectors = np.linalg.eigh(_covariance)
+    _values = np.maximum(_values, 0)
+    l3, l2, l1 = _values[:, 0], _values[:, 1], _values[:, 2]
+    _l1 = np.where(l1 > 0, l1, 1)
+
+    # The normal is the direction of least variance, pointed upward
+    _normals = _vectors[:, :, 0]
+    _normals *= np.where(_normals[:, 2:3] < 0, -1, 1)
+
+    features = np.zeros(stop - start, dtype=GEOMETRY_DTYPE)
+    features["linearity"] = (l1 - l2) / _l1
+    features["planarity"] = (l2 - l3) / _l1
+    features["scattering"] = l3 / _l1
+    features["verticality"] = 1 - np.abs(_normals[:, 2])
+    features["normal_x"], features["normal_y"], features["normal_z"] = _normals.T
+    features["neighbours"] = _counts
+    # Fewer than 3 neighbours span no covariance
+    _few = _counts < 3
+    for name in GEOMETRY_DTYPE.names[:-1]:
+        features[name][_few] = np.nan
+    return features
+
+
+def geometric_features(points: ndarray,
+                       k: int = 16,
+                       radius: Union[float, None] = None,
+                       chunk_size: int = DEFAULT_CHUNK_SIZE,
+                       executor: str = "serial",
+                       workers: Union[int, None] = None) -> ndarray:
+    """Linearity, planarity, scattering, verticality and the upward normal
+       of every point from its k nearest neighbours (itself included),
+       limited to those within radius when given. Returns a GEOMETRY_DTYPE
+       array in point order, NaN where fewer than 3 neighbours were found.
+       With executor 'serial' chunks run one after the other and workers
+       threads share each neighbour query, with 'thread' up to workers
+       chunks run at once. Both share one KD-tree; a process pool would
+       pickle the tree and the points into every task, so it is refused."""
+    if executor == "process":
+        raise ExecutorError("Geometric features share one KD-tree, use executor 'serial' or 'thread'")
+    logging.info("Computing geometric features")
+    _points = np.ascontiguousarray(points[:, :3], dtype=np.float64)
+    k = min(k, len(_points))
+    features = np.empty(len(_points), dtype=GEOMETRY_DTYPE)
+    if len(_points) == 0:
+        return features
+
+    with span("geometric_features", len(_points)) as _span:
+        tree = scipy_spatial.cKDTree(_points)
+        _starts = range(0, len(_points), chunk_size)
+        _query_workers = (workers or 1) if executor == "serial" else 1
+        _tasks = ((tree, _points, start, min(start + chunk_size, len(_points)), k, radius, _query_workers)
+                  for start in _starts)
+        for start, chunk in zip(_starts, map_tasks(_chunk_features, _tasks, executor=executor, workers=workers)):
+            features[start:start + len(chunk)] = chunk
+        _span.points_out = len(features)
+    return features
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,68 @@
+import numpy as np
+
+from numpy import ndarray
+from typing import List
+from wolflas.instrumentation import span
+from wolflas.backends import lazy_module
+
+shapely = lazy_module("shapely")
+csgraph = lazy_module("scipy.sparse.csgraph")
+scipy_sparse = lazy_module("scipy.sparse")
+
+'''Array wide geometry steps on shapely 2 ufuncs. Every function takes all the
+    geometries (or point groups) of a cloud at once and hands them to shapely
+    as one array, so no Python loop runs per polygon.'''
+
+
+def base_centroids(bases: List[ndarray]) -> ndarray:
+    """XY centroid of the convex hull of every point group, as an (n, 2)
+       array. The points need no order; groups that span no area give the
+       centroid of their line or point."""
+    if len(bases) == 0:
+        return np.empty((0, 2))
+    _coords = np.concatenate([base[:, :2] for base in bases])
+    _ids = np.repeat(np.arange(len(bases)), [len(base) for base in bases])
+    _hulls = shapely.convex_hull(shapely.multipoints(_coords, indices=_ids))
+    return shapely.get_coordinates(shapely.centroid(_hulls))
+
+
+def simplify_hulls(hulls: ndarray,
+                   tolerance: float = 0.5) -> ndarray:
+    """Simplified copy of every hull, empty hulls dropped"""
+    _hulls = np.asarray(hulls, dtype=object)
+    _hulls = _hulls[~shapely.is_empty(_hulls)]
+    return shapely.simplify(_hulls, tolerance=tolerance)
+
+
+def merge_hulls(hulls: ndarray) -> ndarray:
+    """Joins hulls that overlap or touch into one geometry per connected
+       group; duplicates collapse into a single hull. Intersecting pairs
+       come from one STRtree query over every hull, groups keep the order
+       of their first hull."""
+    _hulls = np.asarray(hulls, dtype=object)
+    if len(_hulls) < 2:
+        return _hulls
+
+    with span("hull_merge", len(_hulls)) as _span:
+        _left, _right = shapely.STRtree(_hulls).query(_hulls, predicate="intersects")
+        _graph = scipy_sparse.coo_matrix((np.ones(len(_left), dtype=np.int8), (_left, _right)),
+                                         shape=(len(_hulls), len(_hulls)))
+        _, _groups = csgraph.connected_components(_graph, directed=False)
+
+        # Groups renumbered by their first hull, single hulls kept as they are
+        _, _first, _groups = np.unique(_groups, return_index=True, return_inverse=True)
+        _order = np.argsort(_first)
+        _rank = np.empty_like(_order)
+        _rank[_order] = np.arange(len(_order))
+        _groups = _rank[_groups.ravel()]
+        _sizes = np.bincount(_groups)
+
+        merged = _hulls[np.sort(_first)].copy()
+        for group in np.flatnonzero(_sizes > 1):
+            merged[group] = shapely.union_all(_hulls[_groups == group])
+        _span.points_out = len(merged)
+    return merged
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,194 @@
+import contextvars
+import logging
+import time
+import tracemalloc
+
+from typing import Callable, Dict, List, Union
+
+'''Lightweight spans for timing pipeline stages. A Recorder collects one Span
+    per stage with its duration, point counts in and out and optionally its
+    peak traced allocation. Library functions open spans with span(), which
+    only records while a span of an enabled Recorder is open around the call,
+    so an uninstrumented run pays a single context variable lookup per stage.'''
+
+_current = contextvars.ContextVar("wolflas_span", default=None)
+
+
+class _NullSpan:
+    """Stand in for a span while nothing is recorded. Every attribute
+       assignment is dropped."""
+
+    points_in = None
+    points_out = None
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        pass
+
+    def __setattr__(self, name, value) -> None:
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span:
+    __slots__ = ("name", "depth", "points_in", "points_out", "seconds", "peak_bytes",
+                 "recorder", "parent", "_start", "_memory_start", "_peak", "_mark", "_token")
+
+    def __init__(self,
+                 recorder: "Recorder",
+                 name: str,
+                 points_in: Union[int, None] = None,
+                 parent: Union["Span", None] = None) -> None:
+        self.name = name
+        self.points_in = points_in
+        self.points_out = None
+        self.seconds = None
+        self.peak_bytes = None
+        self.recorder = recorder
+        self.parent = parent
+        self.depth = 0 if parent is None else parent.depth + 1
+
+    def __enter__(self) -> "Span":
+        self.recorder.spans.append(self)
+        self._token = _current.set(self)
+        if self.recorder.trace_memory:
+            self.recorder._memory_enter(self)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.seconds = time.perf_counter() - self._start
+        if self.recorder.trace_memory:
+            self.recorder._memory_exit(self)
+        _current.reset(self._token)
+        for callback in self.recorder.callbacks:
+            callback(self)
+
+    def as_dict(self) -> dict:
+        return {"name": self.name,
+                "depth": self.depth,
+                "seconds": self.seconds,
+                "points_in": self.points_in,
+                "points_out": self.points_out,
+                "peak_bytes": self.peak_bytes}
+
+
+class Recorder:
+    def __init__(self,
+                 enabled: bool = True,
+                 trace_memory: bool = False,
+                 callbacks: Union[List[Callable], None] = None) -> None:
+        """Collects spans while enabled. With trace_memory every span also
+           records the peak allocation above its starting point, measured
+           with tracemalloc (started on demand, which slows allocations
+           down while it runs). Spans running at once on pool threads share
+           tracemalloc's single peak, so their peaks overlap. Before Python
+           3.9 the peak can't be reset, a span whose peak stays under an
+           earlier one only reports the memory it still holds when it
+           closes. callbacks are
+           called with each span as it closes."""
+        self.enabled = enabled
+        self.trace_memory = trace_memory
+        self.callbacks = list(callbacks) if callbacks is not None else []
+        self.spans = []
+        self._tracing_root = None
+
+    def span(self,
+             name: str,
+             points_in: Union[int, None] = None) -> Union[Span, _NullSpan]:
+        if not self.enabled:
+            return NULL_SPAN
+        _parent = _current.get()
+        if _parent is not None and _parent.recorder is not self:
+            _parent = None
+        return Span(self, name, points_in, _parent)
+
+    @staticmethod
+    def _reset_peak() -> None:
+        # reset_peak is Python 3.9+, before that the peak only ever grows
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+
+    @staticmethod
+    def _peak_of(span: Span,
+                 peak: int) -> int:
+        """Peak reading attributable to span. Without reset_peak a peak no
+           higher than the one seen when span opened may predate it, and
+           only the span's own readings are kept."""
+        return peak if peak > span._mark else span._peak
+
+    def _memory_enter(self,
+                      span: Span) -> None:
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing_root = span
+        _current_bytes, _peak = tracemalloc.get_traced_memory()
+        # The peak so far belongs to the parent, it is folded in before resetting
+        if span.parent is not None and hasattr(span.parent, "_peak"):
+            span.parent._peak = max(span.parent._peak, self._peak_of(span.parent, _peak))
+        self._reset_peak()
+        span._memory_start = _current_bytes
+        span._peak = _current_bytes
+        span._mark = tracemalloc.get_traced_memory()[1]
+
+    def _memory_exit(self,
+                     span: Span) -> None:
+        if not hasattr(span, "_peak"):
+            return
+        _current_bytes, _peak = tracemalloc.get_traced_memory()
+        span._peak = max(span._peak, self._peak_of(span, _peak), _current_bytes)
+        span.peak_bytes = span._peak - span._memory_start
+        if span.parent is not None and hasattr(span.parent, "_peak"):
+            span.parent._peak = max(span.parent._peak, span._peak)
+        self._reset_peak()
+        if self._tracing_root is span:
+            tracemalloc.stop()
+            self._tracing_root = None
+
+    def report(self) -> List[dict]:
+        """Every recorded span in the order they were opened"""
+        return [span.as_dict() for span in self.spans if span.seconds is not None]
+
+    def summary(self) -> Dict[str, dict]:
+        """Spans totalled by name, for stages that run once per cluster"""
+        _summary = {}
+        for span in self.spans:
+            if span.seconds is None:
+                continue
+            _entry = _summary.setdefault(span.name, {"calls": 0, "seconds": 0.0, "points_in": 0,
+                                                     "points_out": 0, "peak_bytes": None})
+            _entry["calls"] += 1
+            _entry["seconds"] += span.seconds
+            _entry["points_in"] += span.points_in or 0
+            _entry["points_out"] += span.points_out or 0
+            if span.peak_bytes is not None:
+                _entry["peak_bytes"] = max(_entry["peak_bytes"] or 0, span.peak_bytes)
+        return _summary
+
+    def clear(self) -> None:
+        self.spans = []
+
+
+def span(name: str,
+         points_in: Union[int, None] = None) -> Union[Span, _NullSpan]:
+    """Span of the recorder active in the current context, or a no-op span
+       when no recorder is recording"""
+    _parent = _current.get()
+    if _parent is None:
+        return NULL_SPAN
+    return _parent.recorder.span(name, points_in)
+
+
+def log_span(span: Span) -> None:
+    """Callback writing every finished span to the log"""
+    _counts = f" {span.points_in} -> {span.points_out} points" if span.points_in is not None else ""
+    _memory = f", peak {span.peak_bytes / 2 ** 20:.1f} MiB" if span.peak_bytes is not None else ""
+    logging.info(f"{'  ' * span.depth}{span.name}: {span.seconds:.3f}s{_counts}{_memory}")
+
+
+if __name__ == "__main__":
+    pass
@@ -3,50 +3,158 @@ import laspy
 import logging
 
 from numpy import ndarray
+from typing import Iterator, Sequence, Tuple, Union
+from wolflas.pointdata import PointData, FIELD_NAMES, COORDINATE_TYPES
+from wolflas.instrumentation import span
+from wolflas.exceptions import FieldError
 
-logging.basicConfig(level=logging.INFO)
+# Number of points decoded per block when streaming a file
+DEFAULT_CHUNK_SIZE = 1_000_000
 
 
-def read(file: str) -> ndarray:
+def select_fields(fields: Union[Sequence[str], None] = None) -> Union[Tuple[str, ...], None]:
+    """Requested fields in storage order with points always included,
+       or None for every field"""
+    if fields is None:
+        return None
+    _unknown = set(fields) - set(FIELD_NAMES)
+    if _unknown:
+        raise FieldError(f"Unknown fields {sorted(_unknown)}, fields must be in {FIELD_NAMES}")
+    return tuple(name for name in FIELD_NAMES if name == "points" or name in fields)
+
+
+def _grid(header,
+          coordinates: str = "float64") -> Tuple[Union[ndarray, None], Union[ndarray, None]]:
+    """Scales and offsets of the points column for a coordinate storage.
+       int32 keeps the header grid, float32 is relative to the header minimum
+       floored to whole units, float64 is real coordinates."""
+    if coordinates not in COORDINATE_TYPES:
+        raise FieldError(f"Coordinates must be one of {tuple(COORDINATE_TYPES)}")
+    if coordinates == "int32":
+        return np.asarray(header.scales, dtype=np.float64), np.asarray(header.offsets, dtype=np.float64)
+    if coordinates == "float32":
+        return np.ones(3), np.floor(np.asarray(header.mins, dtype=np.float64))
+    return None, None
+
+
+def _fill_point_data(records,
+                     out: PointData) -> PointData:
+    """Copies a laspy point record into typed columns. Only the columns of
+       out are unpacked, dimensions missing from the point format (ex.
+       gps_time in format 0) are left as zeros. int32 points take the raw
+       record integers, float32 points are shifted to out.offsets before
+       narrowing so no precision is lost to large projected coordinates."""
+    _dimensions = set(records.point_format.dimension_names)
+
+    _points = out["points"]
+    if _points.dtype == np.int32:
+        _points[:, 0] = records.X
+        _points[:, 1] = records.Y
+        _points[:, 2] = records.Z
+    elif _points.dtype == np.float32:
+        _points[:, 0] = np.asarray(records.x) - out.offsets[0]
+        _points[:, 1] = np.asarray(records.y) - out.offsets[1]
+        _points[:, 2] = np.asarray(records.z) - out.offsets[2]
+    else:
+        _points[:, 0] = records.x
+        _points[:, 1] = records.y
+        _points[:, 2] = records.z
+    for name in out.fields[1:]:
+        if name in _dimensions:
+            out[name] = records[name]
+        else:
+            out[name] = 0
+    return out
+
+
+def _overlaps(header,
+              bbox: Union[Sequence[float], None]) -> bool:
+    if bbox is None:
+        return True
+    return (header.mins[0] <= bbox[2] and header.maxs[0] >= bbox[0] and
+            header.mins[1] <= bbox[3] and header.maxs[1] >= bbox[1])
+
+
+def _records(fh,
+             chunk_size: int,
+             classes: Union[Sequence[int], None] = None,
+             bbox: Union[Sequence[float], None] = None) -> Iterator:
+    """Point records of an open file, chunk by chunk. With classes or an
+       (xmin, ymin, xmax, ymax) bbox, rows are dropped from the packed
+       record before any dimension is unpacked."""
+    if not _overlaps(fh.header, bbox):
+        return
+    for records in fh.chunk_iterator(chunk_size):
+        if classes is None and bbox is None:
+            yield records
+            continue
+
+        _mask = np.ones(len(records), dtype=bool)
+        if classes is not None:
+            _mask &= np.isin(np.asarray(records.classification), classes)
+        if bbox is not None:
+            _x, _y = np.asarray(records.x), np.asarray(records.y)
+            _mask &= (_x >= bbox[0]) & (_x <= bbox[2]) & (_y >= bbox[1]) & (_y <= bbox[3])
+        if _mask.all():
+            yield records
+        elif _mask.any():
+            yield records[_mask]
+
+
+def read_chunks(file: str,
+                chunk_size: int = DEFAULT_CHUNK_SIZE,
+                fields: Union[Sequence[str], None] = None,
+                classes: Union[Sequence[int], None] = None,
+                bbox: Union[Sequence[float], None] = None,
+                coordinates: str = "float64") -> Iterator[PointData]:
+    """Yields the points of a las/laz file in blocks of at most
+       chunk_size points. Only one chunk is held in memory at a time.
+       fields, classes, bbox and coordinates work as in read."""
+    logging.info(f"Streaming file {file}")
+    _fields = select_fields(fields)
+    with laspy.open(file) as fh:
+        _scales, _offsets = _grid(fh.header, coordinates)
+        for records in _records(fh, chunk_size, classes, bbox):
+            yield _fill_point_data(records, PointData.empty(len(records), _fields, coordinates, _scales, _offsets))
+
+
+def read(file: str,
+         chunk_size: int = DEFAULT_CHUNK_SIZE,
+         fields: Union[Sequence[str], None] = None,
+         classes: Union[Sequence[int], None] = None,
+         bbox: Union[Sequence[float], None] = None,
+         coordinates: str = "float64") -> PointData:
+    """Reads a las/laz file into typed columns. fields limits the columns
+       decoded (points are always read), classes and an (xmin, ymin, xmax,
+       ymax) bbox drop points chunk by chunk while reading, so memory
+       follows the selected subset. coordinates 'int32' keeps the raw las
+       integers and 'float32' local coordinates, each half the size of
+       float64, PointData.xyz gives real coordinates back."""
     # Reading our file
     logging.info(f"Reading file {file}")
-    with laspy.open(file) as fh:
-        las = fh.read()
-    # Converting las to v 1.4
-    las = laspy.convert(las, file_version='1.4')
-
-    # GRABBING METADATA FROM LAS FILE
-    points = np.vstack((las.x, las.y, las.z)).transpose()
-    intensity = np.array(las.intensity)
-    return_number = np.array(las.return_number)
-    number_of_returns = np.array(las.number_of_returns)
-    scan_direction_flag = np.array(las.scan_direction_flag)
-    edge_of_flight_line = np.array(las.edge_of_flight_line)
-    classification = np.array(las.classification)
-    synthetic = np.array(las.synthetic)
-    key_point = np.array(las.key_point)
-    withheld = np.array(las.withheld)
-    user_data = np.array(las.user_data)
-    point_source_id = np.array(las.point_source_id)
-    gps_time = np.array(las.gps_time)
-
-    # MASTER ARRAY WITH POINTS AND CORRESPONDING METADATA
-    las_data = np.empty([len(points), 16], dtype=np.float64)
-    las_data[:, 0] = points[:, 0]
-    las_data[:, 1] = points[:, 1]
-    las_data[:, 2] = points[:, 2]
-    las_data[:, 3] = intensity
-    las_data[:, 4] = return_number
-    las_data[:, 5] = number_of_returns
-    las_data[:, 6] = scan_direction_flag
-    las_data[:, 7] = edge_of_flight_line
-    las_data[:, 8] = classification
-    las_data[:, 9] = synthetic
-    las_data[:, 10] = key_point
-    las_data[:, 11] = withheld
-    las_data[:, 12] = user_data
-    las_data[:, 13] = point_source_id
-    las_data[:, 14] = gps_time
+    _fields = select_fields(fields)
+
+    # TYPED COLUMNS WITH POINTS AND CORRESPONDING METADATA
+    # Filled chunk by chunk so only a single decoded block is alive
+    # next to the columns
+    with span("read") as _span, laspy.open(file) as fh:
+        _span.points_in = fh.header.point_count
+        _scales, _offsets = _grid(fh.header, coordinates)
+        if classes is None and bbox is None:
+            las_data = PointData.empty(fh.header.point_count, _fields, coordinates, _scales, _offsets)
+            start = 0
+            for records in _records(fh, chunk_size):
+                stop = start + len(records)
+                _fill_point_data(records, las_data[start:stop])
+                start = stop
+            las_data = las_data[:start]
+        else:
+            # The subset size is unknown up front, kept chunks are joined once
+            las_data = PointData.concatenate([_fill_point_data(records, PointData.empty(len(records), _fields,
+                                                                                        coordinates, _scales, _offsets))
+                                              for records in _records(fh, chunk_size, classes, bbox)]
+                                             or [PointData.empty(0, _fields, coordinates, _scales, _offsets)])
+        _span.points_out = len(las_data)
 
     logging.info(f"{len(las_data)} points read from file")
     return las_data
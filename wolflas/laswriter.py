@@ -1,65 +1,114 @@
 import numpy as np
 import os
 import laspy
+import logging
 
-from numpy import ndarray
+from typing import Iterable, Sequence, Union
+from wolflas.pointdata import PointData, LAS_ATTRIBUTES
+from wolflas.exceptions import BackendError
+from wolflas.instrumentation import span
 
+# Number of points packed per block when writing
+DEFAULT_CHUNK_SIZE = 1_000_000
 
-def write(data: ndarray,
+LAZ_BACKENDS = {"lazrs": laspy.LazBackend.Lazrs,
+                "lazrs_parallel": laspy.LazBackend.LazrsParallel,
+                "laszip": laspy.LazBackend.Laszip}
+
+
+def _laz_backend(name: Union[str, None]):
+    if name is None:
+        return None
+    if name not in LAZ_BACKENDS:
+        raise BackendError(f"Laz backend must be one of {tuple(LAZ_BACKENDS)}")
+    _backend = LAZ_BACKENDS[name]
+    if not _backend.is_available():
+        raise BackendError(f"Laz backend {name} is not installed")
+    return _backend
+
+
+def write(data: PointData,
           point_format: int = 3,
           version: str = "1.2",
           filename: str = "default",
-          path: str = os.getcwd()):
-    
-    if version == "1.2":
-        print(f"Writing to {path}\{filename}.las")
-        # Changing classes over 31 to 0
-        data[:, 8][data[:, 8] > 31] = 0
-
-        new_header = laspy.LasHeader(point_format=point_format, version=version)
-        new_las = laspy.LasData(new_header)
-        new_las.x = data[:, 0]
-        new_las.y = data[:, 1]
-        new_las.z = data[:, 2]
-        new_las.intensity = data[:, 3]
-        new_las.return_number = data[:, 4]
-        new_las.number_of_returns = data[:, 5]
-        new_las.scan_direction_flag = data[:, 6]
-        new_las.edge_of_flight_line = data[:, 7]
-        new_las.classification = data[:, 8]
-        new_las.synthetic = data[:, 9]
-        new_las.key_point = data[:, 10]
-        new_las.withheld = data[:, 11]
-        new_las.user_data = data[:, 12]
-        new_las.point_source_id = data[:, 13]
-        new_las.gps_time = data[:, 14]
+          path: str = os.getcwd(),
+          laz: bool = False,
+          laz_backend: Union[str, None] = None,
+          chunk_size: int = DEFAULT_CHUNK_SIZE) -> int:
+    """Writes typed point columns to a las (or laz) file. The columns are
+       packed chunk_size points at a time straight from their native
+       dtypes, so only one packed block exists next to the data. int32
+       points are written on their own grid without being rescaled."""
+    _int32 = data["points"].dtype == np.int32
+    return write_chunks((data[start:start + chunk_size] for start in range(0, len(data), chunk_size)),
+                        point_format=point_format,
+                        version=version,
+                        filename=filename,
+                        path=path,
+                        scales=data.scales if _int32 else None,
+                        offsets=data.offsets if _int32 else None,
+                        laz=laz,
+                        laz_backend=laz_backend)
 
-        new_las.write(f"{path}/{filename}.las")
-        print(f"{filename}.las created")
 
-    else:
-        print(f"Writing to {path}\{filename}.las")
-        new_header = laspy.LasHeader(point_format=point_format, version=version)
+def write_chunks(chunks: Iterable[PointData],
+                 point_format: int = 3,
+                 version: str = "1.2",
+                 filename: str = "default",
+                 path: str = os.getcwd(),
+                 scales: Union[Sequence[float], None] = None,
+                 offsets: Union[Sequence[float], None] = None,
+                 laz: bool = False,
+                 laz_backend: Union[str, None] = None) -> int:
+    """Appends point chunks to a las file one block at a time so the whole
+       cloud never has to be in memory. With laz the file is compressed,
+       optionally with a given backend ('lazrs', 'lazrs_parallel' or
+       'laszip'). Returns the number of points written."""
+    _extension = "laz" if laz else "las"
+    logging.info(f"Writing to {path}/{filename}.{_extension}")
+    new_header = laspy.LasHeader(point_format=point_format, version=version)
+    if scales is not None:
+        new_header.scales = np.asarray(scales, dtype=np.float64)
+    if offsets is not None:
+        new_header.offsets = np.asarray(offsets, dtype=np.float64)
 
-        new_las = laspy.LasData(new_header)
-        new_las.x = data[:, 0]
-        new_las.y = data[:, 1]
-        new_las.z = data[:, 2]
-        new_las.intensity = data[:, 3]
-        new_las.return_number = data[:, 4]
-        new_las.number_of_returns = data[:, 5]
-        new_las.scan_direction_flag = data[:, 6]
-        new_las.edge_of_flight_line = data[:, 7]
-        new_las.classification = data[:, 8]
-        new_las.synthetic = data[:, 9]
-        new_las.key_point = data[:, 10]
-        new_las.withheld = data[:, 11]
-        new_las.user_data = data[:, 12]
-        new_las.point_source_id = data[:, 13]
-        new_las.gps_time = data[:, 14]
+    _dimensions = set(new_header.point_format.dimension_names)
+    point_count = 0
+    with span("write") as _span, laspy.open(f"{path}/{filename}.{_extension}",
+                                           mode="w",
+                                           header=new_header,
+                                           do_compress=laz,
+                                           laz_backend=_laz_backend(laz_backend)) as writer:
+        for data in chunks:
+            records = laspy.ScaleAwarePointRecord.zeros(len(data), header=new_header)
+            _points = data["points"]
+            if (_points.dtype == np.int32 and np.array_equal(data.scales, new_header.scales)
+                    and np.array_equal(data.offsets, new_header.offsets)):
+                # Raw las integers on the header's grid go through untouched
+                records.X = _points[:, 0]
+                records.Y = _points[:, 1]
+                records.Z = _points[:, 2]
+            else:
+                _points = data.xyz()
+                records.x = _points[:, 0]
+                records.y = _points[:, 1]
+                records.z = _points[:, 2]
+            for name in LAS_ATTRIBUTES:
+                # Fields left out when reading are written as zeros
+                if name not in _dimensions or name not in data:
+                    continue
+                _column = data[name]
+                if name == "classification" and version == "1.2":
+                    # Changing classes over 31 to 0 without touching the caller's chunk
+                    _column = np.where(_column > 31, 0, _column)
+                records[name] = _column.astype(records[name].dtype, copy=False)
+            writer.write_points(records)
+            point_count += len(data)
+        _span.points_in = point_count
+        _span.points_out = point_count
 
-        new_las.write(f"{path}/{filename}.las")
-        print(f"{filename}.las created")
+    logging.info(f"{filename}.{_extension} created")
+    return point_count
 
 
 if __name__ == "__main__":
@@ -1,17 +1,80 @@
 import numpy as np
 
 from numpy import ndarray
-from typing import Union
+from typing import Iterable, Union
+
+
+class Normalizer:
+    """Per axis affine transform, (value - offset) * scale. Fitted once from
+       the min and max of a point set (or of its chunks) so points can be
+       normalized and reverted any number of times without scanning them
+       again. transform and inverse accept out= to write into an existing
+       array, which may be the input itself."""
+
+    def __init__(self,
+                 offset: ndarray,
+                 scale: ndarray) -> None:
+        self.offset = np.asarray(offset, dtype=np.float64)
+        self.scale = np.asarray(scale, dtype=np.float64)
+
+    @classmethod
+    def from_bounds(cls,
+                    min_values: ndarray,
+                    max_values: ndarray,
+                    normal_value: Union[int, float] = 1) -> "Normalizer":
+        _range = np.asarray(max_values, dtype=np.float64) - min_values
+        # Flat axes are only shifted
+        _range[_range == 0] = 1
+        return cls(offset=min_values, scale=normal_value / _range)
+
+    @classmethod
+    def fit(cls,
+            data: ndarray,
+            normal_value: Union[int, float] = 1) -> "Normalizer":
+        return cls.from_bounds(data.min(axis=0), data.max(axis=0), normal_value)
+
+    @classmethod
+    def fit_chunks(cls,
+                   chunks: Iterable[ndarray],
+                   normal_value: Union[int, float] = 1) -> "Normalizer":
+        """Fits on a stream of chunks, keeping only a running min and max"""
+        min_values, max_values = None, None
+        for chunk in chunks:
+            if len(chunk) == 0:
+                continue
+            _min, _max = chunk.min(axis=0), chunk.max(axis=0)
+            min_values = _min if min_values is None else np.minimum(min_values, _min)
+            max_values = _max if max_values is None else np.maximum(max_values, _max)
+        return cls.from_bounds(min_values, max_values, normal_value)
+
+    def transform(self,
+                  data: ndarray,
+                  out: Union[ndarray, None] = None,
+                  dtype=np.float32) -> ndarray:
+        """Normalizes data into out, or into a new array of dtype"""
+        if out is None:
+            out = np.empty(data.shape, dtype=dtype)
+        np.subtract(data, self.offset, out=out, casting="same_kind")
+        np.multiply(out, self.scale.astype(out.dtype), out=out)
+        return out
+
+    def inverse(self,
+                data: ndarray,
+                out: Union[ndarray, None] = None,
+                dtype=np.float64) -> ndarray:
+        """Reverts normalized data into out, or into a new array of dtype"""
+        if out is None:
+            out = np.empty(data.shape, dtype=dtype)
+        np.divide(data, self.scale, out=out, casting="same_kind")
+        np.add(out, self.offset, out=out, casting="same_kind")
+        return out
 
 
 def compute_normals(data: ndarray,
                     normal_value: int = 1) -> tuple:
-    min_val = min(data)
-    max_val = max(data)
-    normalized = np.empty(len(data))
-
-    for key, value in enumerate(data):
-        normalized[key] = (value - min_val) / (max_val - min_val) * normal_value
+    min_val = data.min()
+    max_val = data.max()
+    normalized = (data - min_val) / (max_val - min_val) * normal_value
 
     return normalized, min_val, max_val
 
@@ -20,49 +83,29 @@ def revert_normals(data: ndarray,
                    normal_value: int,
                    min_value: Union[int, float],
                    max_value: Union[int, float]) -> ndarray:
-    reverted = np.empty(len(data))
-
-    for key, value in enumerate(data):
-        reverted[key] = value * (max_value - min_value) + min_value
-
-    return reverted
+    return data / normal_value * (max_value - min_value) + min_value
 
 
 def normalize_pointset(data: ndarray,
                        normal_value: int = 1) -> tuple:
-    xset = data[:, 0]
-    yset = data[:, 1]
-    zset = data[:, 2]
+    points = data[:, :3]
+    min_values = points.min(axis=0)
+    max_values = points.max(axis=0)
+    normalized_set = (points - min_values) / (max_values - min_values) * normal_value
 
-    normalized_set = np.empty((len(data), 3))
-    normalized_set[:, 0], x_min, x_max = compute_normals(xset, normal_value=normal_value)
-    normalized_set[:, 1], y_min, y_max = compute_normals(yset, normal_value=normal_value)
-    normalized_set[:, 2], z_min, z_max = compute_normals(zset, normal_value=normal_value)
-
-    return normalized_set, [x_min, y_min, z_min], [x_max, y_max, z_max]
+    return normalized_set, list(min_values), list(max_values)
 
 
 def revert_normalization(data: ndarray,
                          min_values: list,
                          max_values: list,
                          normal_value: int) -> ndarray:
-    xset = data[:, 0]
-    yset = data[:, 1]
-    zset = data[:, 2]
-
-    x_min = min_values[0]
-    y_min = min_values[1]
-    z_min = min_values[2]
-
-    x_max = max_values[0]
-    y_max = max_values[1]
-    z_max = max_values[2]
-
-    reverted_set = np.empty((len(data), 3))
-    reverted_set[:, 0] = revert_normals(xset, normal_value=normal_value, min_value=x_min, max_value=x_max)
-    reverted_set[:, 1] = revert_normals(yset, normal_value=normal_value, min_value=y_min, max_value=y_max)
-    reverted_set[:, 2] = revert_normals(zset, normal_value=normal_value, min_value=z_min, max_value=z_max)
+    min_values = np.asarray(min_values, dtype=np.float64)
+    max_values = np.asarray(max_values, dtype=np.float64)
+
+    reverted_set = data[:, :3] / normal_value * (max_values - min_values) + min_values
     return reverted_set
 
+
 if __name__ == "__main__":
-    pass
\ No newline at end of file
+    pass
@@ -0,0 +1,124 @@
+import contextvars
+import numpy as np
+import os
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from numpy import ndarray
+from typing import Callable, Iterable, Iterator, List, Union
+from wolflas.exceptions import ExecutorError
+
+'''Runs a function over every cluster of a grouped point array. Clusters are
+    contiguous ranges of one array, so a process pool only has to share that
+    single array (through shared memory) instead of pickling every cluster.
+    Thread tasks run in a copy of the caller's context, so spans opened by
+    func nest under the caller's span. Process workers have no recorder,
+    spans opened inside them are not recorded.'''
+
+
+EXECUTORS = ("serial", "thread", "process")
+
+# Set in every pool worker by _attach_shared
+_shared_block = None
+_shared_points = None
+
+
+def _attach_shared(name: str,
+                   shape: tuple,
+                   dtype: str) -> None:
+    global _shared_block, _shared_points
+    from multiprocessing import shared_memory
+    _shared_block = shared_memory.SharedMemory(name=name)
+    _shared_points = np.ndarray(shape, dtype=dtype, buffer=_shared_block.buf)
+
+
+def _run_shared(task: tuple):
+    func, start, stop, kwargs = task
+    return func(_shared_points[start:stop], **kwargs)
+
+
+def map_clusters(func: Callable,
+                 points: ndarray,
+                 order: ndarray,
+                 bounds: ndarray,
+                 executor: str = "serial",
+                 workers: Union[int, None] = None,
+                 **kwargs) -> List:
+    """Calls func(cluster, **kwargs) for every cluster, where cluster i is
+       points[order[bounds[i]:bounds[i + 1]]], and returns the results in
+       cluster order. executor is 'serial', 'thread' or 'process'. For a
+       process pool func must be importable at module level and the spans
+       it opens are lost."""
+    if executor not in EXECUTORS:
+        raise ExecutorError(f"Executor must be one of {EXECUTORS}")
+
+    _cluster_count = len(bounds) - 1
+    if _cluster_count <= 0:
+        return []
+
+    if executor != "process":
+        _grouped = points[order]
+        _clusters = (_grouped[bounds[i]:bounds[i + 1]] for i in range(_cluster_count))
+        if executor == "serial" or workers == 1:
+            return [func(cluster, **kwargs) for cluster in _clusters]
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # One context copy per task, a context can't be entered by two threads at once
+            _futures = [pool.submit(contextvars.copy_context().run, func, cluster, **kwargs)
+                        for cluster in _clusters]
+            return [future.result() for future in _futures]
+
+    # Python 3.8+ only, imported here so serial and thread runs work without it
+    from multiprocessing import shared_memory
+
+    # Gathering the clusters straight into one shared block
+    _shape = (len(order),) + points.shape[1:]
+    _block = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(_shape)) * points.itemsize))
+    _grouped = np.ndarray(_shape, dtype=points.dtype, buffer=_block.buf)
+    try:
+        np.take(points, order, axis=0, out=_grouped)
+
+        _workers = workers if workers is not None else os.cpu_count()
+        _tasks = [(func, bounds[i], bounds[i + 1], kwargs) for i in range(_cluster_count)]
+        with ProcessPoolExecutor(max_workers=_workers,
+                                 initializer=_attach_shared,
+                                 initargs=(_block.name, _shape, points.dtype.str)) as pool:
+            return list(pool.map(_run_shared, _tasks,
+                                 chunksize=max(1, _cluster_count // (_workers * 4))))
+    finally:
+        del _grouped
+        _block.close()
+        _block.unlink()
+
+
+def map_tasks(func: Callable,
+              tasks: Iterable[tuple],
+              executor: str = "serial",
+              workers: Union[int, None] = None) -> Iterator:
+    """Yields func(*task) for every task, in task order. Tasks are pulled
+       from the iterable lazily and at most two per worker are in flight,
+       so memory follows the task size rather than the task count. Spans
+       are kept with threads and lost with processes, as in map_clusters."""
+    if executor not in EXECUTORS:
+        raise ExecutorError(f"Executor must be one of {EXECUTORS}")
+
+    if executor == "serial" or workers == 1:
+        for task in tasks:
+            yield func(*task)
+        return
+
+    _workers = workers if workers is not None else os.cpu_count()
+    _pool_type = ThreadPoolExecutor if executor == "thread" else ProcessPoolExecutor
+    with _pool_type(max_workers=_workers) as pool:
+        _pending = []
+        for task in tasks:
+            if executor == "thread":
+                _pending.append(pool.submit(contextvars.copy_context().run, func, *task))
+            else:
+                _pending.append(pool.submit(func, *task))
+            if len(_pending) >= _workers * 2:
+                yield _pending.pop(0).result()
+        for future in _pending:
+            yield future.result()
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,156 @@
+import numpy as np
+
+from numpy import ndarray
+from typing import Dict, Iterable, Sequence, Union
+
+
+# Column name, dtype and row shape of every point attribute kept by WolfLas.
+# Dtypes follow the native las record so nothing is widened on read.
+FIELDS = (("points", np.float64, (3,)),
+          ("intensity", np.uint16, ()),
+          ("return_number", np.uint8, ()),
+          ("number_of_returns", np.uint8, ()),
+          ("scan_direction_flag", np.uint8, ()),
+          ("edge_of_flight_line", np.uint8, ()),
+          ("classification", np.uint8, ()),
+          ("synthetic", np.uint8, ()),
+          ("key_point", np.uint8, ()),
+          ("withheld", np.uint8, ()),
+          ("user_data", np.uint8, ()),
+          ("point_source_id", np.uint16, ()),
+          ("gps_time", np.float64, ()))
+
+FIELD_NAMES = tuple(name for name, _, _ in FIELDS)
+
+# Storage of the points column. float64 holds real coordinates, int32 the
+# raw las integers and float32 coordinates relative to a local origin, both
+# turned into real coordinates with points * scales + offsets.
+COORDINATE_TYPES = {"float64": np.float64, "float32": np.float32, "int32": np.int32}
+
+# Las attributes stored one to one in a column of the same name
+LAS_ATTRIBUTES = FIELD_NAMES[1:]
+
+
+class PointData:
+    """Columnar point storage. Every attribute lives in its own contiguous
+       array of its native dtype. Indexing with a column name returns that
+       column, indexing with a mask, slice or index array returns a new
+       PointData holding the selected rows of every column.
+       Quantized points (int32 or float32) carry the scales and offsets
+       that map them to real coordinates, see xyz."""
+
+    def __init__(self,
+                 columns: Dict[str, ndarray],
+                 scales: Union[Sequence[float], None] = None,
+                 offsets: Union[Sequence[float], None] = None) -> None:
+        self.columns = columns
+        self.scales = np.ones(3) if scales is None else np.asarray(scales, dtype=np.float64)
+        self.offsets = np.zeros(3) if offsets is None else np.asarray(offsets, dtype=np.float64)
+
+    @classmethod
+    def empty(cls,
+              point_count: int,
+              fields: Union[Sequence[str], None] = None,
+              coordinates: str = "float64",
+              scales: Union[Sequence[float], None] = None,
+              offsets: Union[Sequence[float], None] = None) -> "PointData":
+        """Allocates uninitialised columns for point_count points, for every
+           field or only the given ones. coordinates is the storage of the
+           points column, one of COORDINATE_TYPES."""
+        return cls({name: np.empty((point_count,) + shape,
+                                   dtype=COORDINATE_TYPES[coordinates] if name == "points" else dtype)
+                    for name, dtype, shape in FIELDS if fields is None or name in fields},
+                   scales, offsets)
+
+    @classmethod
+    def concatenate(cls,
+                    parts: Iterable["PointData"]) -> "PointData":
+        """Joins parts row wise. Parts quantized on different grids (ex. two
+           tiles with their own offsets) are joined as real coordinates."""
+        parts = list(parts)
+        if len(parts) == 0:
+            return cls.empty(0)
+        _first = parts[0]
+        if all(part.same_grid(_first) for part in parts[1:]):
+            return cls({name: np.concatenate([part.columns[name] for part in parts])
+                        for name in _first.columns}, _first.scales, _first.offsets)
+        _columns = {name: np.concatenate([part.columns[name] for part in parts])
+                    for name in _first.columns if name != "points"}
+        _columns["points"] = np.concatenate([part.xyz() for part in parts])
+        return cls({name: _columns[name] for name in _first.columns})
+
+    def __len__(self) -> int:
+        return len(self.columns["points"])
+
+    def __contains__(self,
+                     name: str) -> bool:
+        return name in self.columns
+
+    @property
+    def fields(self) -> tuple:
+        return tuple(self.columns)
+
+    def __getitem__(self,
+                    key: Union[str, slice, ndarray]) -> Union[ndarray, "PointData"]:
+        if isinstance(key, str):
+            return self.columns[key]
+        return PointData({name: column[key] for name, column in self.columns.items()}, self.scales, self.offsets)
+
+    def __setitem__(self,
+                    key: str,
+                    value: ndarray) -> None:
+        self.columns[key][...] = value
+
+    def copy(self) -> "PointData":
+        return PointData({name: column.copy() for name, column in self.columns.items()}, self.scales, self.offsets)
+
+    @property
+    def quantized(self) -> bool:
+        """True when the points column is not real float64 coordinates"""
+        return (self.columns["points"].dtype != np.float64 or
+                not (np.all(self.scales == 1) and np.all(self.offsets == 0)))
+
+    def same_grid(self,
+                  other: "PointData") -> bool:
+        """True when both points columns share dtype, scales and offsets"""
+        return (self.columns["points"].dtype == other.columns["points"].dtype and
+                np.array_equal(self.scales, other.scales) and np.array_equal(self.offsets, other.offsets))
+
+    def inside(self,
+               bbox: Sequence[float]) -> ndarray:
+        """Mask of the points inside an (xmin, ymin, xmax, ymax) box, compared
+           on the stored coordinates with the box moved onto their grid"""
+        _points = self.columns["points"]
+        _lower = (np.asarray(bbox[:2], dtype=np.float64) - self.offsets[:2]) / self.scales[:2]
+        _upper = (np.asarray(bbox[2:4], dtype=np.float64) - self.offsets[:2]) / self.scales[:2]
+        return ((_points[:, 0] >= _lower[0]) & (_points[:, 0] <= _upper[0]) &
+                (_points[:, 1] >= _lower[1]) & (_points[:, 1] <= _upper[1]))
+
+    def quantize(self,
+                 xyz: ndarray) -> ndarray:
+        """Real coordinates moved onto the grid and dtype of the points column"""
+        _dtype = self.columns["points"].dtype
+        _grid = (np.asarray(xyz, dtype=np.float64) - self.offsets) / self.scales
+        if np.issubdtype(_dtype, np.integer):
+            _grid = np.round(_grid)
+        return _grid.astype(_dtype)
+
+    def xyz(self,
+            rows: Union[slice, ndarray, None] = None) -> ndarray:
+        """Real float64 coordinates of the given rows (every row by default).
+           Plain float64 points are returned without a copy, quantized
+           points are converted here, only for the rows asked for."""
+        _points = self.columns["points"]
+        if rows is not None:
+            _points = _points[rows]
+        if not self.quantized:
+            return _points
+        return _points * self.scales + self.offsets
+
+    @property
+    def nbytes(self) -> int:
+        return sum(column.nbytes for column in self.columns.values())
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,196 @@
+import numpy as np
+import logging
+
+from numpy import ndarray
+from typing import Iterable, Sequence, Tuple, Union
+from wolflas.pointdata import PointData
+from wolflas.instrumentation import span
+from wolflas.exceptions import RasterError
+from wolflas.backends import lazy_module
+
+ndimage = lazy_module("scipy.ndimage")
+
+'''Min, max, mean and count grids of point heights. Points are binned chunk by
+    chunk into fixed grids, so memory follows the grid size rather than the
+    point count. Row 0 is the southern edge of the grid, rows grow northward.'''
+
+STATISTICS = ("min", "max", "mean", "count")
+
+
+class Raster:
+    def __init__(self,
+                 bounds: Sequence[float],
+                 cell_size: float) -> None:
+        """Empty grids covering the (xmin, ymin, xmax, ymax) bounds with
+           square cells of cell_size"""
+        self.origin = np.asarray(bounds[:2], dtype=np.float64)
+        self.cell_size = float(cell_size)
+        _extent = np.asarray(bounds[2:4], dtype=np.float64) - self.origin
+        self.shape = (int(np.floor(_extent[1] / cell_size)) + 1, int(np.floor(_extent[0] / cell_size)) + 1)
+
+        self.count = np.zeros(self.shape, dtype=np.uint32)
+        self.sum = np.zeros(self.shape, dtype=np.float64)
+        self.min = np.full(self.shape, np.inf, dtype=np.float64)
+        self.max = np.full(self.shape, -np.inf, dtype=np.float64)
+
+    def cells_of(self,
+                 xy: ndarray) -> Tuple[ndarray, ndarray]:
+        """Row and column of every XY position, -1 outside the grid"""
+        _cells = np.floor((np.asarray(xy, dtype=np.float64)[:, :2] - self.origin) / self.cell_size).astype(np.int64)
+        _rows, _cols = _cells[:, 1], _cells[:, 0]
+        _outside = (_rows < 0) | (_rows >= self.shape[0]) | (_cols < 0) | (_cols >= self.shape[1])
+        _rows[_outside] = -1
+        _cols[_outside] = -1
+        return _rows, _cols
+
+    def add(self,
+            points: ndarray) -> None:
+        """Bins the heights of points into the grids. Points outside the
+           grid are ignored."""
+        _rows, _cols = self.cells_of(points)
+        _inside = _rows >= 0
+        _flat = _rows[_inside] * self.shape[1] + _cols[_inside]
+        _z = points[_inside, 2]
+        if len(_flat) == 0:
+            return
+
+        # Statistics per touched cell from one sort of this chunk's cells,
+        # so the work follows the chunk rather than the grid
+        _order = np.argsort(_flat, kind="stable")
+        _sorted = _flat[_order]
+        _starts = np.flatnonzero(np.r_[True, _sorted[1:] != _sorted[:-1]])
+        _cells = _sorted[_starts]
+        _z = _z[_order]
+        _count, _sum = self.count.reshape(-1), self.sum.reshape(-1)
+        _min, _max = self.min.reshape(-1), self.max.reshape(-1)
+        _count[_cells] += np.diff(np.r_[_starts, len(_sorted)]).astype(np.uint32)
+        _sum[_cells] += np.add.reduceat(_z, _starts)
+        _min[_cells] = np.minimum(_min[_cells], np.minimum.reduceat(_z, _starts))
+        _max[_cells] = np.maximum(_max[_cells], np.maximum.reduceat(_z, _starts))
+
+    def grid(self,
+             statistic: str = "mean") -> ndarray:
+        """One of the min, max, mean or count grids. Empty cells are NaN
+           (0 for count)."""
+        if statistic not in STATISTICS:
+            raise RasterError(f"Statistic must be one of {STATISTICS}")
+        if statistic == "count":
+            return self.count
+        _empty = self.count == 0
+        if statistic == "mean":
+            _grid = self.sum / np.maximum(self.count, 1)
+        else:
+            _grid = getattr(self, statistic).copy()
+        _grid[_empty] = np.nan
+        return _grid
+
+    def sample(self,
+               xy: ndarray,
+               statistic: str = "min") -> ndarray:
+        """Grid value under every XY position, NaN outside the grid"""
+        _rows, _cols = self.cells_of(xy)
+        _values = self.grid(statistic)[_rows, _cols].astype(np.float64)
+        _values[_rows < 0] = np.nan
+        return _values
+
+    def save(self,
+             path: str) -> None:
+        """Saves every grid with its origin and cell size into one compressed
+           .npz file, grids as float32 and counts as uint32"""
+        np.savez_compressed(path,
+                            origin=self.origin,
+                            cell_size=self.cell_size,
+                            count=self.count,
+                            min=self.min.astype(np.float32),
+                            max=self.max.astype(np.float32),
+                            sum=self.sum)
+        logging.info(f"Raster saved to {path}")
+
+    @classmethod
+    def load(cls,
+             path: str) -> "Raster":
+        with np.load(path) as fh:
+            _shape = fh["count"].shape
+            _origin = fh["origin"]
+            _cell_size = float(fh["cell_size"])
+            # The far corner half a cell inside the last column and row
+            raster = cls((*_origin, *(_origin + (np.array(_shape[::-1]) - 0.5) * _cell_size)), _cell_size)
+            raster.count[...] = fh["count"]
+            raster.min[...] = fh["min"]
+            raster.max[...] = fh["max"]
+            raster.sum[...] = fh["sum"]
+        return raster
+
+    def write_flt(self,
+                  path: str,
+                  statistic: str = "mean",
+                  nodata: float = -9999.0) -> None:
+        """Writes one grid as an ESRI float grid, a raw float32 .flt file
+           next to a small .hdr text header, readable by GDAL and most GIS"""
+        _base = path[:-4] if path.lower().endswith(".flt") else path
+        _grid = np.asarray(self.grid(statistic), dtype=np.float32)
+        _grid = np.where(np.isnan(_grid), nodata, _grid).astype("<f4")
+        # ESRI grids start at the northern row
+        _grid[::-1].tofile(f"{_base}.flt")
+        with open(f"{_base}.hdr", "w") as f:
+            f.write(f"ncols {self.shape[1]}\nnrows {self.shape[0]}\n"
+                    f"xllcorner {self.origin[0]}\nyllcorner {self.origin[1]}\n"
+                    f"cellsize {self.cell_size}\nNODATA_value {nodata}\nbyteorder LSBFIRST\n")
+        logging.info(f"{statistic} grid written to {_base}.flt")
+
+
+class GroundModel:
+    """Terrain height of every cell, the lowest ground point of the cell.
+       Cells without ground take the height of the nearest cell with ground
+       so the model can be sampled anywhere."""
+
+    def __init__(self,
+                 raster: Raster) -> None:
+        self.origin = raster.origin
+        self.cell_size = raster.cell_size
+        self.shape = raster.shape
+
+        _heights = raster.grid("min")
+        _empty = np.isnan(_heights)
+        if _empty.all():
+            raise RasterError("No ground points to build a ground model from")
+        if _empty.any():
+            _nearest = ndimage.distance_transform_edt(_empty, return_distances=False, return_indices=True)
+            _heights = _heights[tuple(_nearest)]
+        self.heights = _heights
+
+    def height_at(self,
+                  xy: ndarray) -> ndarray:
+        """Ground height under every XY position. Positions off the grid
+           take the height of the closest edge cell."""
+        _cells = np.floor((np.asarray(xy, dtype=np.float64)[:, :2] - self.origin) / self.cell_size).astype(np.int64)
+        _rows = np.clip(_cells[:, 1], 0, self.shape[0] - 1)
+        _cols = np.clip(_cells[:, 0], 0, self.shape[1] - 1)
+        return self.heights[_rows, _cols]
+
+
+def rasterize(chunks: Iterable[PointData],
+              bounds: Sequence[float],
+              cell_size: float,
+              classes: Union[Sequence[int], None] = None,
+              return_numbers: Union[Sequence[int], None] = None) -> Raster:
+    """Bins point chunks into a Raster over (xmin, ymin, xmax, ymax),
+       keeping only the given classes and return numbers if any"""
+    raster = Raster(bounds, cell_size)
+    with span("rasterize") as _span:
+        _points_in = 0
+        for chunk in chunks:
+            _points_in += len(chunk)
+            _mask = np.ones(len(chunk), dtype=bool)
+            if classes is not None:
+                _mask &= np.isin(chunk["classification"], classes)
+            if return_numbers is not None:
+                _mask &= np.isin(chunk["return_number"], return_numbers)
+            raster.add(chunk.xyz(_mask))
+        _span.points_in = _points_in
+        _span.points_out = int(raster.count.sum())
+    return raster
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,154 @@
+import numpy as np
+
+from numpy import ndarray
+from typing import Sequence, Tuple, Union
+from wolflas.backends import lazy_module
+
+scipy_spatial = lazy_module("scipy.spatial")
+
+'''XY grid index with a lazily built KD-tree per occupied cell. Built once
+    per point set and reused for every bounding box, radius and nearest
+    neighbour query. All queries return index arrays into the original
+    points, never copies of them. Quantized points are indexed as stored,
+    queries are moved onto their grid.'''
+
+
+class SpatialIndex:
+    def __init__(self,
+                 points: ndarray,
+                 cell_size: float = 50.0,
+                 dims: int = 3,
+                 scales: Union[Sequence[float], None] = None,
+                 offsets: Union[Sequence[float], None] = None) -> None:
+        """Sorts points into square XY cells of cell_size. Radius and
+           nearest neighbour queries measure distance over the first
+           dims coordinates (2 for XY only, 3 for XYZ).
+           points may be stored quantized (see PointData), real
+           coordinates being points * scales + offsets. Queries take real
+           coordinates, only the KD-trees of the cells queried hold
+           converted points."""
+        self.points = points
+        self.cell_size = float(cell_size)
+        self.dims = dims
+        self.scales = np.ones(3) if scales is None else np.asarray(scales, dtype=np.float64)
+        self.offsets = np.zeros(3) if offsets is None else np.asarray(offsets, dtype=np.float64)
+        # Cell size in stored units
+        self._grid_size = self.cell_size / self.scales[:2]
+        self.origin = points[:, :2].min(axis=0) if len(points) > 0 else np.zeros(2)
+
+        _cells = self._cells_of(points[:, :2])
+        self.shape = _cells.max(axis=0) + 1 if len(points) > 0 else np.zeros(2, dtype=np.int64)
+        _keys = _cells[:, 0] * self.shape[1] + _cells[:, 1]
+
+        # Counting points per cell and laying them out cell after cell
+        self.order = np.argsort(_keys, kind="stable")
+        self.keys, _starts = np.unique(_keys[self.order], return_index=True)
+        self.bounds = np.append(_starts, len(points))
+        self._trees = {}
+
+    def _cells_of(self,
+                  xy: ndarray) -> ndarray:
+        """Cells of stored XY positions"""
+        return np.floor((np.asarray(xy, dtype=np.float64) - self.origin) / self._grid_size).astype(np.int64)
+
+    def _to_grid(self,
+                 xy: Sequence) -> ndarray:
+        """Real XY positions moved onto the stored grid"""
+        return (np.asarray(xy, dtype=np.float64) - self.offsets[:2]) / self.scales[:2]
+
+    def _cell_range(self,
+                    lower: ndarray,
+                    upper: ndarray) -> ndarray:
+        """Positions in self.keys of the occupied cells between two cell
+           coordinates, inclusive"""
+        lower = np.maximum(lower, 0)
+        upper = np.minimum(upper, self.shape - 1)
+        if np.any(upper < lower):
+            return np.empty(0, dtype=np.int64)
+
+        _rows = np.arange(lower[0], upper[0] + 1)
+        _first = np.searchsorted(self.keys, _rows * self.shape[1] + lower[1], side="left")
+        _last = np.searchsorted(self.keys, _rows * self.shape[1] + upper[1], side="right")
+        return np.concatenate([np.arange(a, b) for a, b in zip(_first, _last)])
+
+    def _members(self,
+                 positions: ndarray) -> ndarray:
+        if len(positions) == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate([self.order[self.bounds[p]:self.bounds[p + 1]] for p in positions])
+
+    def _tree(self,
+              position: int) -> tuple:
+        _members = self.order[self.bounds[position]:self.bounds[position + 1]]
+        if position not in self._trees:
+            _real = self.points[_members, :self.dims] * self.scales[:self.dims] + self.offsets[:self.dims]
+            self._trees[position] = scipy_spatial.cKDTree(_real)
+        return self._trees[position], _members
+
+    def bbox(self,
+             xmin: float,
+             ymin: float,
+             xmax: float,
+             ymax: float) -> ndarray:
+        """Indices of all points inside the XY bounding box, in point order"""
+        (xmin, ymin), (xmax, ymax) = self._to_grid([[xmin, ymin], [xmax, ymax]])
+        _lower, _upper = self._cells_of([[xmin, ymin], [xmax, ymax]])
+        _candidates = self._members(self._cell_range(_lower, _upper))
+        _xy = self.points[_candidates, :2]
+        _inside = ((_xy[:, 0] >= xmin) & (_xy[:, 0] <= xmax) &
+                   (_xy[:, 1] >= ymin) & (_xy[:, 1] <= ymax))
+        return np.sort(_candidates[_inside])
+
+    def radius(self,
+               center: Sequence[float],
+               radius: float) -> ndarray:
+        """Indices of all points within radius of center, in point order"""
+        center = np.asarray(center, dtype=np.float64)[:self.dims]
+        _lower, _upper = self._cells_of(self._to_grid([center[:2] - radius, center[:2] + radius]))
+
+        _found = []
+        for position in self._cell_range(_lower, _upper):
+            tree, members = self._tree(position)
+            _found.append(members[tree.query_ball_point(center, radius)])
+        if len(_found) == 0:
+            return np.empty(0, dtype=np.int64)
+        return np.sort(np.concatenate(_found))
+
+    def nearest(self,
+                center: Sequence[float],
+                k: int = 1) -> Tuple[ndarray, ndarray]:
+        """Distances to and indices of the k nearest points of center,
+           closest first. Rings of cells are added around the center
+           until no unvisited cell can hold a closer point."""
+        center = np.asarray(center, dtype=np.float64)[:self.dims]
+        k = min(k, len(self.points))
+        _home = self._cells_of(self._to_grid([center[:2]]))[0]
+        _distances = np.empty(0)
+        _indices = np.empty(0, dtype=np.int64)
+        _visited = set()
+
+        ring = 0
+        while k > 0:
+            for position in self._cell_range(_home - ring, _home + ring):
+                if position in _visited:
+                    continue
+                _visited.add(position)
+                tree, members = self._tree(position)
+                _d, _i = tree.query(center, k=min(k, len(members)))
+                _distances = np.append(_distances, _d)
+                _indices = np.append(_indices, members[np.atleast_1d(_i)])
+
+            _keep = np.argsort(_distances, kind="stable")[:k]
+            _distances, _indices = _distances[_keep], _indices[_keep]
+            _covered = np.all(_home - ring <= 0) and np.all(_home + ring >= self.shape - 1)
+            if len(_indices) == k and (_distances[-1] <= ring * self.cell_size or _covered):
+                break
+            if _covered:
+                break
+            ring += 1
+
+        return _distances, _indices
+
+
+if __name__ == "__main__":
+    pass
@@ -0,0 +1,96 @@
+import numpy as np
+
+from numpy import ndarray
+from typing import Sequence, Tuple, Union
+from wolflas.instrumentation import span
+from wolflas.exceptions import ThinningError
+
+'''Grid (XY) and voxel (XYZ) thinning. Points are hashed to integer cells and
+    one representative is kept per occupied cell, so the points left depend
+    on where they are rather than on the order they were written in.'''
+
+THINNING_MODES = ("first", "centroid", "lowest", "highest")
+
+
+def cell_inverse(points: ndarray,
+                 cell_size: float,
+                 dims: int = 2,
+                 origin: Union[Sequence[float], None] = None) -> Tuple[ndarray, ndarray]:
+    """Cell of every point over its first dims coordinates. Returns the
+       index of the first point of every occupied cell and, for every point,
+       the position of its cell in that array. Cells start at origin, the
+       minimum of the points by default; a fixed origin keeps the grid the
+       same across chunks."""
+    _coords = points[:, :dims]
+    # A fixed origin takes the dtype of float points so both subtract alike
+    _dtype = _coords.dtype if np.issubdtype(_coords.dtype, np.floating) else np.float64
+    _origin = _coords.min(axis=0) if origin is None else np.asarray(origin, dtype=_dtype)[:dims]
+    _cells = np.floor((_coords - _origin) / cell_size).astype(np.int64)
+    # Points below a fixed origin give negative cells, shifting keeps the
+    # flattened keys unique
+    _cells -= _cells.min(axis=0)
+    _extent = _cells.max(axis=0) + 1
+    _keys = _cells[:, 0]
+    for axis in range(1, dims):
+        _keys = _keys * _extent[axis] + _cells[:, axis]
+    _, first, inverse = np.unique(_keys, return_index=True, return_inverse=True)
+    return first, inverse.ravel()
+
+
+def thin_indices(points: ndarray,
+                 cell_size: float,
+                 mode: str = "first",
+                 dims: int = 2,
+                 origin: Union[Sequence[float], None] = None) -> Tuple[ndarray, ndarray]:
+    """Index of the point kept for every cell (the first one in point order,
+       or the lowest or highest in Z) and the cell of every point."""
+    first, inverse = cell_inverse(points, cell_size, dims, origin)
+    if mode == "first":
+        return first, inverse
+    if mode not in ("lowest", "highest"):
+        raise ThinningError("Index thinning mode must be one of ('first', 'lowest', 'highest')")
+
+    # Sorting by cell, then by height within each cell. The first entry of
+    # every cell run is its representative
+    _z = points[:, 2] if mode == "lowest" else -points[:, 2]
+    _order = np.lexsort((_z, inverse))
+    _starts = np.flatnonzero(np.r_[True, inverse[_order][1:] != inverse[_order][:-1]])
+    return _order[_starts], inverse
+
+
+def cell_means(points: ndarray,
+               inverse: ndarray,
+               cell_count: int) -> ndarray:
+    """Mean of the points of every cell, cells given by inverse"""
+    _counts = np.bincount(inverse, minlength=cell_count)
+    return np.column_stack([np.bincount(inverse, weights=points[:, axis], minlength=cell_count)
+                            for axis in range(points.shape[1])]) / _counts[:, None]
+
+
+def thin(points: ndarray,
+         cell_size: float,
+         mode: str = "first",
+         dims: int = 2) -> Tuple[ndarray, ndarray]:
+    """One point per grid (dims=2) or voxel (dims=3) cell of cell_size.
+       mode is 'first', 'lowest', 'highest' or 'centroid' (the mean of the
+       cell's points). Returns the thinned points and, for every input
+       point, the row of its representative, so results computed on the
+       thinned points can be carried back with result[inverse]."""
+    if mode not in THINNING_MODES:
+        raise ThinningError(f"Thinning mode must be one of {THINNING_MODES}")
+    if len(points) == 0:
+        return points[:0], np.empty(0, dtype=np.int64)
+
+    with span("thin", len(points)) as _span:
+        if mode == "centroid":
+            first, inverse = cell_inverse(points, cell_size, dims)
+            thinned = cell_means(points, inverse, len(first))
+        else:
+            kept, inverse = thin_indices(points, cell_size, mode, dims)
+            thinned = points[kept]
+        _span.points_out = len(thinned)
+    return thinned, inverse
+
+
+if __name__ == "__main__":
+    pass